@@ -0,0 +1,143 @@
+"""
+Нарезка PCM WAV на куски без записи на диск.
+
+Куски - это memoryview поверх буфера, полученного от ffmpeg, плюс
+собственный 44-байтный WAV заголовок. Данные не копируются.
+"""
+import io
+import os
+import struct
+from typing import List
+
+_WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+_UNKNOWN_SIZES = (0, 0xFFFFFFFF)  # ffmpeg не может проставить размер при выводе в pipe
+
+
+class WavFormat:
+    __slots__ = ("channels", "sample_rate", "bits_per_sample", "data_offset", "data_size")
+
+    def __init__(self, channels: int, sample_rate: int, bits_per_sample: int, data_offset: int, data_size: int):
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.bits_per_sample = bits_per_sample
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+    @property
+    def block_align(self) -> int:
+        return self.channels * self.bits_per_sample // 8
+
+    @property
+    def byte_rate(self) -> int:
+        return self.sample_rate * self.block_align
+
+    @property
+    def duration(self) -> float:
+        """Длительность в секундах (по заголовку, без ffprobe)"""
+        return self.data_size / self.byte_rate
+
+
+def parse_wav_header(buf) -> WavFormat:
+    """Разбирает RIFF заголовок и находит начало PCM данных"""
+    view = memoryview(buf)
+    if len(view) < 12 or bytes(view[0:4]) != b'RIFF' or bytes(view[8:12]) != b'WAVE':
+        raise RuntimeError("Не WAV файл: нет RIFF/WAVE заголовка")
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        chunk_size = struct.unpack_from('<I', view, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b'fmt ':
+            _, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', view, body)
+            fmt = (channels, sample_rate, bits)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise RuntimeError("WAV: блок data раньше блока fmt")
+            available = len(view) - body
+            size = available if chunk_size in _UNKNOWN_SIZES else min(chunk_size, available)
+            return WavFormat(fmt[0], fmt[1], fmt[2], body, size)
+        pos = body + chunk_size + (chunk_size & 1)
+    raise RuntimeError("WAV: блок data не найден")
+
+
+def wav_header(fmt: WavFormat, data_size: int) -> bytes:
+    """Стандартный 44-байтный PCM заголовок для куска длиной data_size байт"""
+    return _WAV_HEADER.pack(
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, fmt.channels, fmt.sample_rate, fmt.byte_rate, fmt.block_align, fmt.bits_per_sample,
+        b'data', data_size,
+    )
+
+
+class WavChunk:
+    """Кусок аудио: заголовок + срез PCM (memoryview без копирования)"""
+    __slots__ = ("index", "header", "pcm", "duration")
+
+    def __init__(self, index: int, header: bytes, pcm: memoryview, duration: float):
+        self.index = index
+        self.header = header
+        self.pcm = pcm
+        self.duration = duration
+
+    @property
+    def size(self) -> int:
+        return len(self.header) + len(self.pcm)
+
+    def open(self) -> io.RawIOBase:
+        """Файлоподобный объект для загрузки куска как multipart файла"""
+        return _WavChunkReader(self)
+
+
+class _WavChunkReader(io.RawIOBase):
+    def __init__(self, chunk: WavChunk):
+        self._parts = (memoryview(chunk.header), chunk.pcm)
+        self._size = chunk.size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._pos = max(0, min(offset, self._size))
+        return self._pos
+
+    def readinto(self, b) -> int:
+        header, pcm = self._parts
+        written = 0
+        while written < len(b) and self._pos < self._size:
+            if self._pos < len(header):
+                src = header[self._pos:]
+            else:
+                src = pcm[self._pos - len(header):]
+            n = min(len(b) - written, len(src))
+            b[written:written + n] = src[:n]
+            written += n
+            self._pos += n
+        return written
+
+
+def split_wav(buf, chunk_duration: float) -> List[WavChunk]:
+    """Режет WAV буфер на окна по chunk_duration секунд арифметикой смещений"""
+    fmt = parse_wav_header(buf)
+    data = memoryview(buf)[fmt.data_offset:fmt.data_offset + fmt.data_size]
+    window = int(chunk_duration * fmt.sample_rate) * fmt.block_align
+    if window <= 0 or not len(data):
+        return []
+
+    chunks = []
+    for index, start in enumerate(range(0, len(data), window)):
+        pcm = data[start:start + window]
+        chunks.append(WavChunk(index, wav_header(fmt, len(pcm)), pcm, len(pcm) / fmt.byte_rate))
+    return chunks
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+import audio_chunks
+import llm_client
+import metrics
+import stt
+from media_executor import ffmpeg_to_wav_cmd, media_executor
+from outbox import Outbox
+from pipeline_queue import PipelineJob, PipelineQueue
+from scenarios import ScenarioStreamSplitter, Scenario, audio_context, audio_prompt, chatgpt_messages, dump_scenarios
+from session_store import pack_text
+from storage_manager import discard_intermediates
+from stt_cache import SttCache, file_sha256
+from text_split import split_text
+
+logger = logging.getLogger(__name__)
+
+# Файлы-чекпоинты в папке audio_<id>: наличие файла = этап выполнен
+STT_PROGRESS_FILE = "stt_chunks.json"
+STT_TEXT_FILE = "stt_text.txt"
+TRANSCRIPT_SENT_FILE = "transcript.sent"
+GPT_RESPONSE_FILE = "gpt_response.txt"
+DELIVERED_FILE = "delivered"
+
+
+class LeaseLost(RuntimeError):
+    """Аренду задания забрал другой воркер - этот воркер прекращает работу над ним"""
+
+
+def _write_atomic(path: str, data) -> None:
+    """Пишет файл целиком через .part + os.replace - недописанный файл не считается чекпоинтом"""
+    tmp_path = path + ".part"
+    if isinstance(data, str):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+    else:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class AudioPipeline:
+    """
+    Конвейер обработки голосового сообщения: download -> transcribe ->
+    generate -> deliver.
+
+    Обработчик только ставит задание в PipelineQueue. Воркеры (в процессе
+    бота или отдельно - pipeline_worker.py) выполняют этапы по очереди.
+    Результат каждого этапа сохраняется в audio_storage/audio_<id>/, этап
+    сначала проверяет свой чекпоинт - поэтому после перезапуска задание
+    продолжается с последнего незавершённого этапа, а уже распознанные
+    куски аудио не отправляются в STT повторно.
+
+    Раз в maintenance_interval секунд завершённые задания старше retention
+    удаляются из очереди, а счётчики по статусам сохраняются в last_stats
+    (для метрик - без запроса к базе при каждом сборе).
+    """
+
+    def __init__(self, queue: PipelineQueue, bot: Bot, outbox: Outbox, storage: BaseStorage, stt_cache: SttCache,
+                 storage_dir: str, chunk_duration: float, selection_state: str, poll_interval: float = 1.0,
+                 retention: float = 7 * 24 * 3600, maintenance_interval: float = 300):
+        self.queue = queue
+        self.bot = bot
+        self.outbox = outbox
+        self.storage = storage
+        self.stt_cache = stt_cache
+        self.storage_dir = storage_dir
+        self.chunk_duration = chunk_duration
+        self.selection_state = selection_state
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.maintenance_interval = maintenance_interval
+        self.last_stats: Dict[str, int] = {}
+        self._stages = {
+            "download": self._download,
+            "transcribe": self._transcribe,
+            "generate": self._generate,
+            "deliver": self._deliver,
+        }
+        self._workers: List[asyncio.Task] = []
+        self._maintenance: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    async def submit(self, chat_id: int, user_id: int, file_id: str, file_unique_id: Optional[str],
+                     state: Optional[str] = None) -> int:
+        """
+        Ставит голосовое в очередь; возвращает число заданий впереди.
+        state - состояние FSM пользователя в момент отправки (см. _deliver)
+        """
+        job_id = await asyncio.to_thread(self.queue.enqueue, chat_id, user_id, {
+            "file_id": file_id, "file_unique_id": file_unique_id, "state": state,
+        })
+        self._wakeup.set()
+        return await asyncio.to_thread(self.queue.pending_before, job_id)
+
+    def work_dir(self, job: PipelineJob) -> str:
+        path = os.path.join(self.storage_dir, f"audio_{job.id}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    # --- Воркеры ---
+
+    def start(self, workers: int) -> None:
+        """Запускает воркеры в текущем event loop (0 - только постановка в очередь)"""
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._workers = [asyncio.create_task(self._worker(f"{prefix}:{n}")) for n in range(workers)]
+        self._maintenance = asyncio.create_task(self._maintain())
+        if workers:
+            logger.info(f"Конвейер аудио: {workers} воркер(ов)")
+
+    def alive(self) -> bool:
+        """Все запущенные воркеры и обслуживание очереди работают (для /health)"""
+        return not any(task.done() for task in self._workers + [self._maintenance] if task is not None)
+
+    async def stop(self) -> None:
+        tasks = self._workers + ([self._maintenance] if self._maintenance is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._maintenance = None
+
+    async def _maintain(self) -> None:
+        while True:
+            try:
+                purged = await asyncio.to_thread(self.queue.purge, self.retention)
+                if purged:
+                    logger.info(f"Очередь конвейера: удалено старых заданий: {purged}")
+                self.last_stats = await asyncio.to_thread(self.queue.stats)
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания очереди конвейера: {e}")
+            await asyncio.sleep(self.maintenance_interval)
+
+    async def run(self, workers: int) -> None:
+        """Работает до отмены (для отдельного процесса-воркера)"""
+        self.start(workers)
+        try:
+            await asyncio.gather(*self._workers)
+        finally:
+            await self.stop()
+
+    async def _worker(self, name: str) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim, name)
+            except Exception as e:
+                logger.error(f"Очередь конвейера недоступна: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(job)
+
+    async def _process(self, job: PipelineJob) -> None:
+        while True:
+            stage = job.stage
+            try:
+                with metrics.track(f"pipeline_{stage}"):
+                    next_stage = await self._run_stage(job, stage)
+            except asyncio.CancelledError:
+                # Аренда истечёт, и задание продолжит другой воркер с этого же этапа
+                raise
+            except LeaseLost:
+                logger.warning(f"Конвейер {job.id}: аренда потеряна на этапе {stage}, задание ведёт другой воркер")
+                return
+            except Exception as e:
+                logger.error(f"Конвейер {job.id}: ошибка на этапе {stage}: {e}", exc_info=True)
+                if await asyncio.to_thread(self.queue.fail, job, f"{stage}: {e}"):
+                    self.outbox.enqueue(job.chat_id, "Audio qayta ishlashda xatolik yuz berdi.")
+                return
+            logger.info(f"Конвейер {job.id}: этап {stage} выполнен")
+            if not await asyncio.to_thread(self.queue.advance, job, next_stage):
+                logger.warning(f"Конвейер {job.id}: аренда потеряна после этапа {stage}")
+                return
+            if next_stage is None:
+                return
+
+    async def _run_stage(self, job: PipelineJob, stage: str) -> Optional[str]:
+        """Выполняет этап, продлевая аренду каждую треть её срока (долгий STT, повторы)"""
+        task = asyncio.ensure_future(self._stages[stage](job))
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.queue.lease / 3)
+                if done:
+                    return task.result()
+                if not await asyncio.to_thread(self.queue.renew, job):
+                    raise LeaseLost(job.id)
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    # --- Этапы ---
+
+    async def _download(self, job: PipelineJob) -> str:
+        work_dir = self.work_dir(job)
+        payload = job.payload
+        file_unique_id = payload.get("file_unique_id")
+        if file_unique_id:
+            cached_text = self.stt_cache.get_by_file_id(file_unique_id)
+            if cached_text is not None:
+                logger.info(f"STT кэш: {file_unique_id} найден, скачивание пропущено")
+                _write_atomic(os.path.join(work_dir, STT_TEXT_FILE), cached_text)
+                return "generate"
+
+        src_path = payload.get("src_path")
+        if not src_path or not os.path.exists(src_path):
+            tg_file = await self.bot.get_file(payload["file_id"])
+            src_ext = os.path.splitext(tg_file.file_path or "")[1] or ".ogg"
+            src_path = os.path.join(work_dir, f"original{src_ext}")
+            with metrics.track("telegram_download"):
+                await self.bot.download_file(tg_file.file_path, destination=src_path + ".part")
+            os.replace(src_path + ".part", src_path)
+            payload["src_path"] = src_path
+
+        audio_hash = await asyncio.to_thread(file_sha256, src_path)
+        payload["hash"] = audio_hash
+        cached_text = self.stt_cache.get_by_hash(audio_hash)
+        if cached_text is not None:
+            logger.info(f"STT кэш: аудио {audio_hash[:12]} уже распознано, дубликат удалён")
+            self.stt_cache.add_file_id(audio_hash, file_unique_id)
+            os.remove(src_path)
+            _write_atomic(os.path.join(work_dir, STT_TEXT_FILE), cached_text)
+            return "generate"
+        return "transcribe"
+
+    async def _transcribe(self, job: PipelineJob) -> str:
+        work_dir = self.work_dir(job)
+        text_path = os.path.join(work_dir, STT_TEXT_FILE)
+        if os.path.exists(text_path):
+            return "generate"
+
+        # Чекпоинт - только тексты распознанных кусков: {"count": N, "texts": {индекс: текст}}
+        progress_path = os.path.join(work_dir, STT_PROGRESS_FILE)
+        progress = {"count": 0, "texts": {}}
+        if os.path.exists(progress_path):
+            progress = json.loads(await asyncio.to_thread(_read_text, progress_path))
+        done = progress["texts"]
+        count = progress["count"]
+        if not count or len(done) < count:
+            # WAV на диск не пишется: при повторе ffmpeg запускается снова (через общий
+            # медиа-исполнитель), аудио режется в памяти, в STT уходят только недостающие куски
+            wav_bytes = await media_executor.run(job.chat_id, ffmpeg_to_wav_cmd(job.payload["src_path"]))
+            with metrics.track("wav_split"):
+                chunks = audio_chunks.split_wav(wav_bytes, self.chunk_duration)
+            if not chunks:
+                raise RuntimeError("ffmpeg вернул пустое аудио")
+            count = len(chunks)
+            missing = [chunk for chunk in chunks if str(chunk.index) not in done]
+            transcripts = await stt.transcribe_chunks(missing)
+            failed = 0
+            for chunk, transcript in zip(missing, transcripts):
+                if transcript.error is None:
+                    done[str(chunk.index)] = transcript.text
+                else:
+                    failed += 1
+            del wav_bytes, chunks, missing
+            await asyncio.to_thread(
+                _write_atomic, progress_path, json.dumps({"count": count, "texts": done}, ensure_ascii=False)
+            )
+            if failed and job.attempts + 1 < self.queue.max_attempts:
+                raise RuntimeError(f"STT: не распознано кусков: {failed} из {count}")
+
+        combined_text = " ".join(done[str(i)] for i in range(count) if done.get(str(i)))
+        _write_atomic(text_path, combined_text)
+        # Прогресс STT больше не нужен
+        discard_intermediates(work_dir)
+        if combined_text and job.payload.get("hash"):
+            self.stt_cache.put(job.payload["hash"], text_path, job.payload.get("file_unique_id"))
+        logger.info(f"STT текст сохранен в: {text_path}")
+        return "generate" if combined_text else "deliver"
+
+    async def _generate(self, job: PipelineJob) -> str:
+        work_dir = self.work_dir(job)
+        response_path = os.path.join(work_dir, GPT_RESPONSE_FILE)
+        if os.path.exists(response_path):
+            return "deliver"
+        transcript = _read_text(os.path.join(work_dir, STT_TEXT_FILE))
+
+        sent_path = os.path.join(work_dir, TRANSCRIPT_SENT_FILE)
+        if not os.path.exists(sent_path):
+            # Расшифровку показываем сразу, не дожидаясь ChatGPT
+            text_parts = split_text(transcript, 4000)
+            await self.outbox.send_parts(job.chat_id, [
+                "📝 Tanish natijalari:\n" + "=" * 30,
+                *(part if i == 0 else f"[{i + 1}/{len(text_parts)}] {part}" for i, part in enumerate(text_parts)),
+                "🤖 ChatGPT bilan kontent plan tayyorlanmoqda...",
+            ])
+            _write_atomic(sent_path, "")
+        await self.bot.send_chat_action(job.chat_id, "typing")
+
+        response_text = await llm_client.chat_completion(
+            chatgpt_messages(audio_prompt(transcript)), temperature=0.7, max_tokens=4000
+        )
+        _write_atomic(response_path, response_text)
+        return "deliver"
+
+    async def _deliver(self, job: PipelineJob) -> None:
+        work_dir = self.work_dir(job)
+        if os.path.exists(os.path.join(work_dir, DELIVERED_FILE)):
+            return None
+        response_path = os.path.join(work_dir, GPT_RESPONSE_FILE)
+        if not os.path.exists(response_path):
+            await self.outbox.send_parts(job.chat_id, ["Tanish natijasi bo'sh. Yana urinib ko'ring."])
+            _write_atomic(os.path.join(work_dir, DELIVERED_FILE), "")
+            return None
+
+        splitter = ScenarioStreamSplitter()
+        blocks = splitter.feed(_read_text(response_path))
+        last_block = splitter.finish()
+        if last_block:
+            blocks.append(last_block)
+        scenarios = [s for s in map(Scenario.from_block, blocks) if s is not None]
+        await self.outbox.send_parts(job.chat_id, [part for block in blocks for part in split_text(block.strip(), 4000)])
+
+        state = FSMContext(self.storage, StorageKey(bot_id=self.bot.id, chat_id=job.chat_id, user_id=job.user_id))
+        current = await state.get_state()
+        if current not in (job.payload.get("state", current), self.selection_state):
+            # Пока шла обработка, пользователь ушёл дальше (/start, анкета) - его сессию не трогаем
+            logger.info(f"Конвейер {job.id}: состояние {current} изменилось, сессия не обновлена")
+            _write_atomic(os.path.join(work_dir, DELIVERED_FILE), "")
+            return None
+
+        # Состояние пользователя - как после обычной генерации в обработчике
+        # Контекст генерации (расшифровка) нужен для замены сценариев в process_selection
+        transcript = _read_text(os.path.join(work_dir, STT_TEXT_FILE))
+        await state.update_data(scenarios=dump_scenarios(scenarios), gen_context=pack_text(audio_context(transcript)))
+        await state.set_state(self.selection_state)
+        await self.outbox.send_parts(job.chat_id, [
+            "\n♻️ <b>Qaysi mavzular sizga yoqdi?</b>\n\n"
+            "Yoqqan mavzular raqamini yozing (masalan: 1, 5, 10).\n"
+            "Men ularni saqlab qolaman va qolganlarini yangisiga almashtirib beraman.\n\n"
+            "Yoki yangi soha tanlash uchun /start ni bosing."
+        ])
+        _write_atomic(os.path.join(work_dir, DELIVERED_FILE), "")
+        logger.info(f"Аудио и текст сохранены в: {work_dir}")
+        return None
@@ -0,0 +1,280 @@
+import asyncio
+import html
+import logging
+import os
+import time
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from heygen_client import HeyGenClient
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 10  # аватаров на странице выбора
+PAGE_COLUMNS = 2
+PAGE_CACHE_SIZE = 128  # готовых страниц на снимок
+_BUTTON_TEXT_MAX = 32
+
+PICKER_TEXT = "👤 Avatarni tanlang yoki ismining boshini yozing (qidiruv):"
+
+
+class AvatarPage(CallbackData, prefix="avp"):
+    """Листание выбора аватара: версия каталога и страница (-1 - кнопка с номером страницы)"""
+    v: int
+    p: int
+
+
+class AvatarChoice(CallbackData, prefix="avc"):
+    """Выбор аватара: версия каталога и индекс аватара в ней (только для кнопок, в сессию пишется avatar_id)"""
+    v: int
+    i: int
+
+
+def catalog_version(avatars: List[Tuple[str, str]]) -> int:
+    """
+    Версия каталога - CRC32 списка (имя, avatar_id): одинакова после
+    перезапуска и не меняется при обновлении с тем же списком
+    """
+    return zlib.crc32("\n".join(f"{name}\t{avatar_id}" for name, avatar_id in avatars).encode("utf-8"))
+
+
+def _button_text(name: str) -> str:
+    return name if len(name) <= _BUTTON_TEXT_MAX else name[:_BUTTON_TEXT_MAX - 1] + "…"
+
+
+class CatalogSnapshot:
+    """Снимок каталога аватаров с готовыми индексами"""
+    __slots__ = ("version", "fetched_at", "avatars", "name_to_index", "sorted_index", "sorted_keys", "_pages")
+
+    def __init__(self, avatars: List[dict]):
+        self.fetched_at = time.monotonic()
+        # (name, avatar_id) в порядке HeyGen, только аватары с именем
+        self.avatars: List[Tuple[str, str]] = [
+            (av['name'], av.get('avatar_id')) for av in avatars if av.get('name')
+        ]
+        self.version = catalog_version(self.avatars)
+        self.name_to_index: Dict[str, int] = {}
+        for index, (name, _) in enumerate(self.avatars):
+            self.name_to_index.setdefault(name, index)
+        # Индексы аватаров по алфавиту и их имена в нижнем регистре - для поиска по началу имени
+        self.sorted_index: List[int] = sorted(range(len(self.avatars)), key=lambda i: self.avatars[i][0].casefold())
+        self.sorted_keys: List[str] = [self.avatars[i][0].casefold() for i in self.sorted_index]
+        self._pages: "OrderedDict[Tuple[str, int], Tuple[InlineKeyboardMarkup, int]]" = OrderedDict()
+
+    def avatar_id(self, name: str) -> Optional[str]:
+        """avatar_id аватара с таким именем"""
+        index = self.name_to_index.get(name)
+        if index is None:
+            return None
+        return self.avatars[index][1]
+
+    def search(self, prefix: str) -> List[int]:
+        """Индексы аватаров, чьё имя начинается с prefix (без учёта регистра), по алфавиту"""
+        key = prefix.strip().casefold()
+        if not key:
+            return self.sorted_index
+        lo = bisect_left(self.sorted_keys, key)
+        hi = bisect_left(self.sorted_keys, key + "\U0010ffff", lo)
+        return self.sorted_index[lo:hi]
+
+    def page(self, query: str = "", page: int = 0) -> Tuple[Optional[InlineKeyboardMarkup], int]:
+        """
+        Inline клавиатура страницы page среди найденных по query и число найденных.
+
+        Страница строится при первом обращении и кэшируется в снимке
+        (последние PAGE_CACHE_SIZE); None - ничего не найдено.
+        """
+        query = query.strip().casefold()
+        cached = self._pages.get((query, page))
+        if cached is not None:
+            self._pages.move_to_end((query, page))
+            return cached
+        matches = self.search(query)
+        if not matches:
+            return None, 0
+        pages = (len(matches) + PAGE_SIZE - 1) // PAGE_SIZE
+        page = min(max(page, 0), pages - 1)
+        chunk = matches[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        rows = [
+            [
+                InlineKeyboardButton(
+                    text=_button_text(self.avatars[i][0]),
+                    callback_data=AvatarChoice(v=self.version, i=i).pack(),
+                )
+                for i in chunk[start:start + PAGE_COLUMNS]
+            ]
+            for start in range(0, len(chunk), PAGE_COLUMNS)
+        ]
+        if pages > 1:
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton(text="◀️", callback_data=AvatarPage(v=self.version, p=page - 1).pack()))
+            nav.append(InlineKeyboardButton(text=f"{page + 1}/{pages}",
+                                            callback_data=AvatarPage(v=self.version, p=-1).pack()))
+            if page < pages - 1:
+                nav.append(InlineKeyboardButton(text="▶️", callback_data=AvatarPage(v=self.version, p=page + 1).pack()))
+            rows.append(nav)
+        result = (InlineKeyboardMarkup(inline_keyboard=rows), len(matches))
+        self._pages[(query, page)] = result
+        while len(self._pages) > PAGE_CACHE_SIZE:
+            self._pages.popitem(last=False)
+        return result
+
+
+class AvatarCatalog:
+    """
+    Общий для всех пользователей кэш каталога аватаров HeyGen.
+
+    Свежий снимок (моложе ttl) отдаётся сразу. Устаревший тоже отдаётся
+    сразу, а обновление запускается в фоне (stale-while-revalidate).
+    Одновременные запросы к пустому кэшу ждут один общий запрос к HeyGen.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self._snapshot: Optional[CatalogSnapshot] = None
+        # Несколько последних разных снимков: кнопки уже отправленных списков работают после обновления
+        self._history: "OrderedDict[int, CatalogSnapshot]" = OrderedDict()
+        self.history_size = 3
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def _fetch(self) -> Optional[CatalogSnapshot]:
+        api_key = os.getenv('HEYGEN_API_KEY')
+        if not api_key:
+            logger.warning("HEYGEN_API_KEY не задан, каталог аватаров недоступен")
+            return None
+        try:
+            avatars = await HeyGenClient(api_key).get_avatars()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки каталога аватаров: {e}")
+            avatars = None
+        if not avatars:
+            # Ошибка HeyGen: оставляем прежний снимок и пробуем снова через минуту
+            if self._snapshot is not None:
+                self._snapshot.fetched_at = time.monotonic() - self.ttl + 60
+            return self._snapshot
+        snapshot = CatalogSnapshot(avatars)
+        current = self._history.get(snapshot.version)
+        if current is not None:
+            # Список не изменился: та же версия, готовые страницы сохраняются
+            current.fetched_at = snapshot.fetched_at
+            self._history.move_to_end(snapshot.version)
+            self._snapshot = current
+            return current
+        self._snapshot = snapshot
+        self._history[snapshot.version] = snapshot
+        while len(self._history) > self.history_size:
+            self._history.popitem(last=False)
+        logger.info(f"Каталог аватаров обновлён: {len(snapshot.avatars)} шт., версия {snapshot.version:08x}")
+        return snapshot
+
+    def _refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        return self._refresh_task
+
+    def warm(self) -> None:
+        """Загрузить каталог заранее (при старте бота)"""
+        self._refresh()
+
+    async def get(self) -> Optional[CatalogSnapshot]:
+        """Текущий снимок каталога или None, если HeyGen недоступен"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return await asyncio.shield(self._refresh())
+        if time.monotonic() - snapshot.fetched_at > self.ttl:
+            self._refresh()
+        return snapshot
+
+    def snapshot(self, version: Optional[int]) -> Optional[CatalogSnapshot]:
+        """Снимок нужной версии, если он ещё хранится"""
+        return self._history.get(version)
+
+    def resolve(self, version: int, index: int) -> Optional[Tuple[str, str]]:
+        """(имя, avatar_id) по кнопке выбора или None, если снимок уже вытеснен"""
+        snapshot = self._history.get(version)
+        if snapshot is None or not 0 <= index < len(snapshot.avatars):
+            return None
+        return snapshot.avatars[index]
+
+
+avatar_catalog = AvatarCatalog()
+
+
+# --- Выбор аватара: общий для bot.py и heygen_bot_integration.py ---
+
+async def send_picker(message: Message, state: FSMContext, snapshot: CatalogSnapshot, query: str = "") -> bool:
+    """Новое сообщение с первой страницей выбора; False - по query ничего не найдено"""
+    markup, found = snapshot.page(query)
+    if markup is None:
+        return False
+    # В сессии только версия каталога и строка поиска - страницы строятся из общего снимка
+    await state.update_data(avatar_version=snapshot.version, avatar_query=query)
+    text = f"🔎 «{html.escape(query)}» - {found} ta avatar. Tanlang:" if query else PICKER_TEXT
+    await message.answer(text, reply_markup=markup)
+    return True
+
+
+async def _show_current(callback: CallbackQuery, state: FSMContext, notice: str) -> None:
+    """Каталог обновился: то же сообщение показывает актуальный список с первой страницы"""
+    snapshot = await avatar_catalog.get()
+    if snapshot is None:
+        await callback.answer("❌ Avatarlarni yuklashda xatolik", show_alert=True)
+        return
+    await state.update_data(avatar_version=snapshot.version, avatar_query="")
+    markup, _ = snapshot.page()
+    await callback.message.edit_text(PICKER_TEXT, reply_markup=markup)
+    await callback.answer(notice, show_alert=True)
+
+
+async def turn_page(callback: CallbackQuery, callback_data: AvatarPage, state: FSMContext) -> None:
+    """Листание страниц: сообщение редактируется на месте, новое не отправляется"""
+    if callback_data.p < 0:
+        await callback.answer()
+        return
+    snapshot = avatar_catalog.snapshot(callback_data.v)
+    if snapshot is None:
+        await _show_current(callback, state, "Avatarlar ro'yxati yangilandi.")
+        return
+    query = (await state.get_data()).get('avatar_query') or ""
+    markup, _ = snapshot.page(query, callback_data.p)
+    await callback.message.edit_reply_markup(reply_markup=markup)
+    await callback.answer()
+
+
+async def pick(callback: CallbackQuery, callback_data: AvatarChoice,
+               state: FSMContext) -> Optional[Tuple[str, str]]:
+    """Нажатый аватар: (avatar_id, имя); клавиатура заменяется отметкой о выборе"""
+    avatar = avatar_catalog.resolve(callback_data.v, callback_data.i)
+    if avatar is None:
+        await _show_current(callback, state, "Avatarlar ro'yxati yangilandi, qaytadan tanlang.")
+        return None
+    name, avatar_id = avatar
+    await callback.message.edit_text(f"✅ Avatar: <b>{html.escape(name)}</b>")
+    await callback.answer()
+    return avatar_id, name
+
+
+async def pick_by_text(message: Message, state: FSMContext) -> Optional[Tuple[str, str]]:
+    """
+    Аватар, набранный текстом: точное имя - выбор, иначе поиск по началу
+    имени (результаты - новым сообщением) и None.
+    """
+    data = await state.get_data()
+    snapshot = avatar_catalog.snapshot(data.get('avatar_version')) or await avatar_catalog.get()
+    if snapshot is None:
+        await message.answer("❌ Avatarlarni yuklashda xatolik. Iltimos, qaytadan urinib ko'ring.")
+        return None
+    text = (message.text or "").strip()
+    avatar_id = snapshot.avatar_id(text)
+    if avatar_id is not None:
+        return avatar_id, text
+    if not await send_picker(message, state, snapshot, text):
+        await message.answer("❌ Bunday avatar topilmadi. Boshqa harflarni yozing yoki ro'yxatdan tanlang.")
+    return None
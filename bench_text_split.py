@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк разбиения текста для Telegram.
+
+Сравнивает старый алгоритм (склейка строк через +=) с однопроходным
+text_split.split_text на расшифровках ~100 KB: с пунктуацией, без неё
+(типичный ответ STT) и со сценариями ChatGPT.
+
+Запуск: python bench_text_split.py [размер_KB]
+"""
+import random
+import sys
+import time
+
+from text_split import split_text, utf16_len
+
+WORDS = ["salom", "bugun", "biz", "kontent", "haqida", "gaplashamiz", "instagram", "video",
+         "mijoz", "biznes", "natija", "odamlar", "ko'proq", "reels", "🔥", "✅", "muhim"]
+
+
+def legacy_split(text, max_length=4000):
+    """Старая реализация _split_text_for_telegram (для сравнения)"""
+    if len(text) <= max_length:
+        return [text]
+    parts = []
+    current_part = ""
+    for sentence in text.split('. '):
+        if len(current_part) + len(sentence) + 2 <= max_length:
+            current_part = current_part + ". " + sentence if current_part else sentence
+        elif current_part:
+            parts.append(current_part + ".")
+            current_part = sentence
+        else:
+            for word in sentence.split():
+                if len(current_part) + len(word) + 1 <= max_length:
+                    current_part = current_part + " " + word if current_part else word
+                else:
+                    if current_part:
+                        parts.append(current_part)
+                    current_part = word
+    if current_part:
+        parts.append(current_part)
+    return parts
+
+
+def make_text(size: int, kind: str) -> str:
+    rnd = random.Random(42)
+    out, length = [], 0
+    n = 1
+    while length < size:
+        if kind == "scenarios":
+            piece = f"🎥 Kontent {n}\n<b>Hook:</b> " + " ".join(rnd.choices(WORDS, k=8)) + \
+                    "\n<b>Kontent:</b> " + " ".join(rnd.choices(WORDS, k=60)) + ".\n\n"
+            n += 1
+        else:
+            piece = " ".join(rnd.choices(WORDS, k=rnd.randint(5, 20)))
+            piece += ". " if kind == "sentences" else " "
+        out.append(piece)
+        length += len(piece)
+    return "".join(out)
+
+
+def bench(func, text, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parts = func(text)
+        best = min(best, time.perf_counter() - started)
+    return best, parts
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 100 * 1024
+    print(f"Текст: {size // 1024} KB, лимит 4000")
+    for kind in ("sentences", "no_punctuation", "scenarios"):
+        text = make_text(size, kind)
+        old_time, old_parts = bench(legacy_split, text)
+        new_time, new_parts = bench(lambda t: split_text(t, 4000), text)
+        over = sum(1 for p in new_parts if utf16_len(p) > 4000)
+        old_over = sum(1 for p in old_parts if utf16_len(p) > 4000)
+        print(f"{kind:>15}: старый {old_time * 1000:8.2f} ms ({len(old_parts)} ч., >лимита: {old_over}) | "
+              f"новый {new_time * 1000:8.2f} ms ({len(new_parts)} ч., >лимита: {over})")
+
+
+if __name__ == "__main__":
+    main()
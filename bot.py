@@ -1,30 +1,51 @@
 import asyncio
+import html
 import logging
 import os
-import shutil
-import subprocess
-import uuid
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
-import requests
-
-from aiogram import Bot, Dispatcher, F
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from openai import OpenAI
 
 import config
+import llm_client
+import metrics
+import http_clients
+from scenarios import (
+    SCENARIO_COUNT,
+    Scenario,
+    chatgpt_messages,
+    ScenarioStreamSplitter,
+    dump_scenarios,
+    index_scenarios,
+    load_scenarios,
+    parse_scenarios,
+    parse_selection,
+)
+from audio_pipeline import AudioPipeline
+from llm_cache import LlmCache
+from loop_monitor import LoopMonitor
+from media_executor import media_executor
+from metrics import MetricsServer
+from outbox import Outbox
+from pipeline_queue import PipelineQueue
+from text_split import split_text
+from session_store import ExpiringMemoryStorage, SessionJanitor, pack_text, unpack_text
+from storage_manager import StorageManager
+from stt_cache import SttCache
 import time
 import random
 import string
-import re
-from heygen_bot_integration import router as heygen_router
-from heygen_video import HeyGenVideoCreator
+from heygen_bot_integration import router as heygen_router, video_tracker
+from avatar_catalog import AvatarChoice, AvatarPage, avatar_catalog, pick, pick_by_text, send_picker, turn_page
+from webhook_server import run_webhook
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -46,233 +67,266 @@ class UserStates(StatesGroup):
     waiting_for_audio = State()
     waiting_for_avatar = State()
 
+def _create_storage():
+    """FSM хранилище: в памяти процесса или общее в PostgreSQL (FSM_STORAGE=postgres)"""
+    if config.FSM_STORAGE == "postgres":
+        from pg_storage import PostgresStorage
+        return PostgresStorage(
+            host=config.POSTGRES_HOST,
+            port=config.POSTGRES_PORT,
+            user=config.POSTGRES_USER,
+            password=config.POSTGRES_PASSWORD,
+            database=config.POSTGRES_DB,
+            min_size=config.POSTGRES_POOL_MIN,
+            max_size=config.POSTGRES_POOL_MAX,
+        )
+    return ExpiringMemoryStorage()
+
+
 # Initialize bot with FSM storage
-storage = MemoryStorage()
-bot = Bot(token=config.TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+storage = _create_storage()
+# TELEGRAM_API_URL - свой Bot API сервер (local bot-api или фейк нагрузочного теста)
+session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL)) if config.TELEGRAM_API_URL else None
+bot = Bot(token=config.TELEGRAM_BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher(storage=storage)
 dp.include_router(heygen_router)
 
-# OpenAI client
-openai_client = OpenAI(api_key=config.OPENAI_API_KEY)
+# Все многочастные ответы идут через планировщик с лимитами Telegram
+outbox = Outbox(
+    bot,
+    global_rate=config.TG_GLOBAL_RATE,
+    chat_rate=config.TG_CHAT_RATE,
+    chat_burst=config.TG_CHAT_BURST,
+)
 
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-AUDIO_STORAGE_DIR = os.path.join(PROJECT_ROOT, "audio_storage")  # Папка для постоянного хранения
+AUDIO_STORAGE_DIR = config.AUDIO_STORAGE_DIR or os.path.join(PROJECT_ROOT, "audio_storage")  # Папка для постоянного хранения
 CHUNK_DURATION = 48  # секунд
 MAX_FILE_SIZE_MB = 20  # Telegram API limit for getFile
 
 # Создаем папку для хранения аудио и текстов при запуске
 os.makedirs(AUDIO_STORAGE_DIR, exist_ok=True)
 
+# Кэш распознанных текстов: повторно загруженное аудио не распознаётся заново
+stt_cache = SttCache(
+    AUDIO_STORAGE_DIR,
+    max_entries=config.STT_CACHE_MAX_ENTRIES,
+    max_bytes=config.STT_CACHE_MAX_MB * 1024 * 1024,
+    max_age=config.STT_CACHE_MAX_AGE_DAYS * 24 * 3600,
+)
+
+# Кэш ответов ChatGPT на анкету (process_unique)
+llm_cache = LlmCache(
+    max_entries=config.LLM_CACHE_MAX_ENTRIES,
+    ttl=config.LLM_CACHE_TTL_HOURS * 3600,
+    near_distance=config.LLM_CACHE_NEAR_DISTANCE,
+)
+
+# Политика хранения: промежуточные файлы, сроки и квота для аудио
+storage_manager = StorageManager(
+    AUDIO_STORAGE_DIR,
+    original_max_age=config.STORAGE_ORIGINAL_MAX_AGE_DAYS * 24 * 3600,
+    upload_max_age=config.STORAGE_UPLOAD_MAX_AGE_DAYS * 24 * 3600,
+    text_max_age=config.STT_CACHE_MAX_AGE_DAYS * 24 * 3600,
+    max_bytes=config.STORAGE_MAX_MB * 1024 * 1024,
+    sweep_interval=config.STORAGE_SWEEP_INTERVAL,
+)
+
+# Персистентный конвейер голосовых сообщений (воркеры - в боте и/или pipeline_worker.py)
+audio_pipeline = AudioPipeline(
+    PipelineQueue(
+        os.path.join(AUDIO_STORAGE_DIR, "pipeline.sqlite3"),
+        lease=config.PIPELINE_LEASE,
+        max_attempts=config.PIPELINE_MAX_ATTEMPTS,
+    ),
+    bot=bot,
+    outbox=outbox,
+    storage=storage,
+    stt_cache=stt_cache,
+    storage_dir=AUDIO_STORAGE_DIR,
+    chunk_duration=CHUNK_DURATION,
+    selection_state=UserStates.waiting_for_selection.state,
+    retention=config.PIPELINE_RETENTION_HOURS * 3600,
+)
+
+# Простаивающие FSM сессии удаляются, размер сессий - в метриках
+session_janitor = SessionJanitor(
+    storage,
+    idle=config.SESSION_IDLE_HOURS * 3600,
+    interval=config.SESSION_SWEEP_INTERVAL,
+)
+
+# Блокировки event loop: стек в лог, время - в метрики по обработчикам
+loop_monitor = LoopMonitor(config.LOOP_LAG_THRESHOLD) if config.LOOP_LAG_THRESHOLD > 0 else None
+if loop_monitor is not None:
+    loop_monitor.install(dp)
+
+# Очереди и хранилище - в метриках; то, что дорого считать, берётся из последнего фонового обхода
+metrics.gauge("impulse_media_queue", "Медиа-процессы: в очереди и запущено", ["state"], lambda: {
+    ("queued",): media_executor.queue_depth, ("running",): media_executor.stats()["running"],
+})
+metrics.gauge("impulse_pipeline_jobs", "Задания конвейера по статусу и этапу (на момент последнего обхода)", ["state"],
+              lambda: {(key,): count for key, count in audio_pipeline.last_stats.items()})
+metrics.gauge("impulse_storage_bytes", "audio_storage по категориям (на момент последней очистки)", ["category"],
+              lambda: {(category,): size for category, size in storage_manager.last_usage.items()})
+metrics.gauge("impulse_fsm_sessions", "FSM сессии (на момент последнего обхода)", [],
+              lambda: {(): session_janitor.last_usage.get("sessions", 0)})
+metrics.gauge("impulse_fsm_session_bytes", "Данные FSM сессий: всего, в среднем и максимум на сессию", ["stat"],
+              lambda: {(stat,): session_janitor.last_usage.get(f"{stat}_bytes", 0) for stat in ("total", "avg", "max")})
+metrics.gauge("impulse_video_jobs_pending", "Видео HeyGen в ожидании рендера", [],
+              lambda: {(): len(video_tracker.jobs)})
 
-def _get_audio_duration(file_path: str) -> float:
-    """Получает длительность аудио файла в секундах"""
-    cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        file_path
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"ffprobe error: {result.stderr}")
-    try:
-        return float(result.stdout.strip())
-    except ValueError:
-        raise RuntimeError(f"Не удалось определить длительность: {result.stdout}")
-
-
-def _run_ffmpeg_to_wav(src_path: str, dst_path: str) -> None:
-    """Конвертирует аудио в WAV формат (16кГц, моно)"""
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-i", src_path,
-        "-ac", "1",
-        "-ar", "16000",
-        dst_path,
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result.returncode != 0:
-        raise RuntimeError(f"ffmpeg error: {result.stderr.decode(errors='ignore')}")
-
-
-def _split_audio_to_chunks(wav_path: str, temp_dir: str) -> List[str]:
-    """Разрезает аудио на куски по 48 секунд. Возвращает список путей к кускам"""
-    duration = _get_audio_duration(wav_path)
-    chunk_paths = []
-    
-    if duration <= CHUNK_DURATION:
-        # Аудио короче 48 секунд - возвращаем как есть
-        chunk_path = os.path.join(temp_dir, "chunk_0.wav")
-        shutil.copy2(wav_path, chunk_path)
-        chunk_paths.append(chunk_path)
-        return chunk_paths
-    
-    # Разрезаем на куски по 48 секунд
-    chunk_index = 0
-    start_time = 0.0
-    
-    while start_time < duration:
-        chunk_path = os.path.join(temp_dir, f"chunk_{chunk_index}.wav")
-        chunk_duration = min(CHUNK_DURATION, duration - start_time)
-        
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-i", wav_path,
-            "-ss", str(start_time),
-            "-t", str(chunk_duration),
-            "-ac", "1",
-            "-ar", "16000",
-            chunk_path,
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if result.returncode != 0:
-            raise RuntimeError(f"ffmpeg split error: {result.stderr.decode(errors='ignore')}")
-        
-        chunk_paths.append(chunk_path)
-        chunk_index += 1
-        start_time += CHUNK_DURATION
-    
-    return chunk_paths
 
+def _split_text_for_telegram(text: str, max_length: int = 4000) -> List[str]:
+    """Разбивает длинный текст на части для отправки в Telegram (лимит 4096 в UTF-16)"""
+    return split_text(text, max_length)
 
-def _post_to_stt(wav_path: str, filename_for_form: str) -> str:
-    """Отправляет аудио файл в STT API и возвращает распознанный текст"""
-    headers = {"x-api-key": config.MUXLISA_API_KEY}
-    try:
-        with open(wav_path, "rb") as f:
-            files = [("audio", (filename_for_form, f, "audio/wav"))]
-            # Таймаут: 30 секунд на подключение, 120 секунд на чтение
-            resp = requests.post(
-                config.MUXLISA_STT_URL,
-                headers=headers,
-                files=files,
-                data={},
-                timeout=(30, 120)
-            )
-        resp.raise_for_status()
-        try:
-            js = resp.json()
-            for key in ("text", "result", "transcript"):
-                if key in js and isinstance(js[key], str):
-                    return js[key]
-            return str(js)
-        except Exception:
-            return resp.text.strip() or ""
-    except requests.exceptions.Timeout:
-        logger.error(f"Timeout при запросе к STT для файла {filename_for_form}")
-        return ""
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка запроса к STT: {e}")
-        return ""
-
-
-def _split_text_by_scenarios(text: str, max_length: int = 4000) -> List[str]:
-    """
-    Splits text by '🎥 Kontent' delimiter to keep scenarios intact.
+
+def _scenario_parts(block: str) -> List[str]:
+    return _split_text_for_telegram(block.strip())
+
+
+async def _generate_and_send(message: Message, user_prompt: str,
+                             cached_response: Optional[str] = None) -> Tuple[List[Scenario], str]:
     """
-    # Split by the scenario marker, keeping the delimiter
-    parts = re.split(r'(?=🎥 Kontent \d)', text)
-    
-    # Remove empty strings
-    parts = [p for p in parts if p.strip()]
-    
-    final_chunks = []
-    current_chunk = ""
-    
-    for part in parts:
-        if len(current_chunk) + len(part) <= max_length:
-            current_chunk += part
-        else:
-            if current_chunk:
-                final_chunks.append(current_chunk)
-            current_chunk = part
-            
-    if current_chunk:
-        final_chunks.append(current_chunk)
-        
-    # If regex didn't find anything (e.g. error message), fallback to simple split
-    if not final_chunks:
-        return _split_text_for_telegram(text, max_length)
-        
-    return final_chunks
+    Генерирует сценарии через ChatGPT и отправляет их пользователю.
 
+    В режиме OPENAI_STREAMING каждый сценарий '🎥 Kontent N' уходит в чат,
+    как только модель начала следующий. Каждый блок разбирается в Scenario
+    один раз, сразу по закрытии. cached_response (ответ из llm_cache)
+    отправляется так же, без запроса к ChatGPT. Возвращает сценарии и
+    полный текст ответа ('' при ошибке).
+    """
+    splitter = ScenarioStreamSplitter()
+    failed = False
+    scenarios: List[Scenario] = []
+
+    def on_block(block: str) -> None:
+        scenario = Scenario.from_block(block)
+        if scenario is not None:
+            scenarios.append(scenario)
+        # Не ждём отправки: пока чат упирается в лимит, блоки копятся и уходят одним сообщением
+        for part in _scenario_parts(block):
+            outbox.enqueue(message.chat.id, part)
 
-def _split_text_for_telegram(text: str, max_length: int = 4000) -> List[str]:
-    """Разбивает длинный текст на части для отправки в Telegram (лимит ~4096 символов)"""
-    if len(text) <= max_length:
-        return [text]
-    
-    parts = []
-    current_part = ""
-    
-    # Разбиваем по предложениям для лучшей читаемости
-    sentences = text.split('. ')
-    
-    for sentence in sentences:
-        if len(current_part) + len(sentence) + 2 <= max_length:
-            if current_part:
-                current_part += ". " + sentence
-            else:
-                current_part = sentence
+    try:
+        if cached_response is not None:
+            for block in splitter.feed(cached_response):
+                on_block(block)
+        elif config.OPENAI_STREAMING:
+            async for delta in llm_client.stream_chat_completion(
+                chatgpt_messages(user_prompt), temperature=0.7, max_tokens=4000
+            ):
+                for block in splitter.feed(delta):
+                    on_block(block)
         else:
-            if current_chunk := current_part: # Fixed variable name bug in original code if copied
-                parts.append(current_chunk + ".")
-                current_part = sentence
-            else:
-                # Если одно предложение длиннее лимита, разбиваем по словам
-                words = sentence.split()
-                for word in words:
-                    if len(current_part) + len(word) + 1 <= max_length:
-                        if current_part:
-                            current_part += " " + word
-                        else:
-                            current_part = word
-                    else:
-                        if current_part:
-                            parts.append(current_part)
-                            current_part = word
-                        else:
-                            parts.append(word)
-    
-    if current_part:
-        parts.append(current_part)
-    
-    return parts
+            response_text = await llm_client.chat_completion(
+                chatgpt_messages(user_prompt), temperature=0.7, max_tokens=4000
+            )
+            for block in splitter.feed(response_text):
+                on_block(block)
+    except Exception as e:
+        logger.error(f"ChatGPT API xatoligi: {e}")
+        outbox.enqueue(message.chat.id, f"❌ ChatGPT bilan bog'lanishda xatolik: {str(e)}")
+        failed = True
+
+    last_block = splitter.finish()
+    if last_block:
+        on_block(last_block)
+    await outbox.flush(message.chat.id)
+    return scenarios, "" if failed else splitter.text
+
+
+def _questionnaire_context(data: dict) -> str:
+    """Ответы анкеты в виде блока для промпта"""
+    return (
+        f"Soha: {unpack_text(data.get('soha'))}\n"
+        f"Auditoriya: {unpack_text(data.get('auditoriya'))}\n"
+        f"Maqsad: {unpack_text(data.get('maqsad'))}\n"
+        f"Hal qilayotgan muammolar: {unpack_text(data.get('muammolar'))}\n"
+        f"Ta'siri: {unpack_text(data.get('tasir'))}\n"
+        f"Shaxsiy tajriba/Keyslar: {unpack_text(data.get('tajriba'))}\n"
+        f"Istalgan mavzular: {unpack_text(data.get('mavzular'))}\n"
+        f"O'ziga xoslik (USP): {unpack_text(data.get('unique'))}\n\n"
+    )
 
 
-def _extract_scenario(text: str, number: int) -> Optional[str]:
-    """Extracts the content of a specific scenario number."""
-    pattern = rf"(🎥 Kontent {number}\s*.*?)(?=\n🎥 Kontent \d|\Z)"
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return None
+async def _generate_replacements(context: str, kept: Dict[int, Scenario], numbers: List[int]) -> Dict[int, Scenario]:
+    """Генерирует только сценарии с номерами numbers (одним небольшим запросом)"""
+    kept_hooks = "\n".join(f"- {scenario.summary()}" for scenario in kept.values())
+    prompt = (
+        context
+        + ("--------------------------------------------------\n"
+           f"SAQLANGAN MAVZULAR (ularni takrorlamang):\n{kept_hooks}\n"
+           "--------------------------------------------------\n" if kept else "")
+        + "🎯 TOPSHIRIQ:\n"
+        f"Yuqoridagi ma'lumotlardan kelib chiqib, Instagram Reels uchun ROPPA-ROSA {len(numbers)} TA yangi viral mavzu "
+        "va HeyGen avatari gapirishi uchun tayyor matn (skript) yozing.\n"
+        f"Mavzular raqamlari: {', '.join(map(str, numbers))}.\n\n"
+        "Talablar:\n"
+        "- Saqlangan mavzularni takrorlamang, har bir ssenariy turlicha bo'lsin (turli formatlar va yondashuvlar).\n"
+        "- Foydalanuvchining shaxsiy tajribasi va o'ziga xosligini inobatga oling.\n\n"
+        "Javobingiz qat'iy quyidagi formatda bo'lsin (har bir mavzu uchun):\n\n"
+        "🎥 Kontent {raqam}\n"
+        "<b>Hook:</b> [Videoni boshlash uchun 3 soniyalik kuchli ilmoq/gap]\n"
+        "<b>Kontent:</b> [Video nima haqida bo'lishi, vizual tavsif va g'oya]\n\n"
+        "Barcha javoblar O'zbek tilida bo'lsin."
+    )
+    response_text = await llm_client.chat_completion(
+        chatgpt_messages(prompt), temperature=0.7, max_tokens=350 * len(numbers)
+    )
+    generated = parse_scenarios(response_text)
+    by_number = index_scenarios(generated)
+    if all(n in by_number for n in numbers):
+        return {n: by_number[n] for n in numbers}
+    # Модель пронумеровала по-своему - раскладываем по порядку
+    return {n: scenario.renumbered(n) for n, scenario in zip(numbers, generated)}
 
 
-async def _send_to_chatgpt(user_prompt: str) -> str:
-    """Отправляет текст в ChatGPT с заданным промптом"""
-    messages = [
-        {
-            "role": "system", 
-            "content": "Siz Instagram algoritmini chuqur tahlil qilgan, 100.000+ prosmotr olgan kontentlarni analiz qilgan kontent strateg mutaxassissiz."
-        },
-        {"role": "user", "content": user_prompt}
-    ]
+async def _regenerate_scenarios(context: str, kept: Dict[int, Scenario], total: int = SCENARIO_COUNT,
+                                on_ready: Optional[Callable[[Scenario], None]] = None) -> List[Scenario]:
+    """
+    Оставляет выбранные сценарии как есть и генерирует только недостающие.
 
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=4000
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        logger.error(f"ChatGPT API xatoligi: {e}")
-        return f"❌ ChatGPT bilan bog'lanishda xatolik: {str(e)}"
+    Недостающие номера делятся на группы по REGEN_BATCH_SIZE и запрашиваются
+    параллельно; результат собирается обратно в порядке номеров. on_ready
+    получает сценарии по порядку, как только готовы все номера до них -
+    их можно отправлять, не дожидаясь остальных групп.
+    """
+    missing = [n for n in range(1, total + 1) if n not in kept]
+    batch = max(1, config.REGEN_BATCH_SIZE)
+    groups = [missing[i:i + batch] for i in range(0, len(missing), batch)]
+    merged = dict(kept)
+    pending = set(missing)
+    released = 0
+
+    async def generate(group: List[int]):
+        try:
+            return group, await _generate_replacements(context, kept, group)
+        except Exception as e:
+            return group, e
+
+    def release() -> None:
+        nonlocal released
+        while released < total and released + 1 not in pending:
+            released += 1
+            if on_ready is not None and released in merged:
+                on_ready(merged[released])
+
+    for next_done in asyncio.as_completed([generate(group) for group in groups]):
+        group, result = await next_done
+        pending.difference_update(group)
+        if isinstance(result, Exception):
+            logger.error(f"ChatGPT API xatoligi (mavzular {group}): {result}")
+        else:
+            merged.update(result)
+        # Пока не пришло ни одного нового сценария, ничего не отправляем: запрос может целиком упасть
+        if len(merged) > len(kept):
+            release()
+    if len(merged) == len(kept) and missing:
+        raise RuntimeError("ChatGPT yangi mavzu qaytarmadi")
+    release()
+    return [merged[n] for n in sorted(merged)]
 
 
 @dp.message(Command("start"))
@@ -288,7 +342,7 @@ async def start_cmd(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_soha)
 async def process_soha(message: Message, state: FSMContext):
-    await state.update_data(soha=message.text)
+    await state.update_data(soha=pack_text(message.text))
     await state.set_state(UserStates.waiting_for_auditoriya)
     await message.answer(
         "2️⃣ <b>Auditoriyangiz kim?</b>\n"
@@ -298,7 +352,7 @@ async def process_soha(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_auditoriya)
 async def process_auditoriya(message: Message, state: FSMContext):
-    await state.update_data(auditoriya=message.text)
+    await state.update_data(auditoriya=pack_text(message.text))
     await state.set_state(UserStates.waiting_for_maqsad)
     await message.answer(
         "3️⃣ <b>Maqsadingiz nima?</b>\n"
@@ -308,7 +362,7 @@ async def process_auditoriya(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_maqsad)
 async def process_maqsad(message: Message, state: FSMContext):
-    await state.update_data(maqsad=message.text)
+    await state.update_data(maqsad=pack_text(message.text))
     await state.set_state(UserStates.waiting_for_muammolar)
     await message.answer(
         "4️⃣ <b>Siz hozirda sohangizda qanday muammolarni hal qilayapsiz?</b>"
@@ -317,7 +371,7 @@ async def process_maqsad(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_muammolar)
 async def process_muammolar(message: Message, state: FSMContext):
-    await state.update_data(muammolar=message.text)
+    await state.update_data(muammolar=pack_text(message.text))
     await state.set_state(UserStates.waiting_for_tasir)
     await message.answer(
         "5️⃣ <b>Sohangiz odamlar hayotiga qanday ta’sir o’tkazayapti?</b>\n"
@@ -327,7 +381,7 @@ async def process_muammolar(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_tasir)
 async def process_tasir(message: Message, state: FSMContext):
-    await state.update_data(tasir=message.text)
+    await state.update_data(tasir=pack_text(message.text))
     await state.set_state(UserStates.waiting_for_tajriba)
     await message.answer(
         "6️⃣ <b>Shaxsiy biror tajribangizni gapirib bersangiz sohangiz bo'yicha?</b>\n"
@@ -337,7 +391,7 @@ async def process_tasir(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_tajriba)
 async def process_tajriba(message: Message, state: FSMContext):
-    await state.update_data(tajriba=message.text)
+    await state.update_data(tajriba=pack_text(message.text))
     await state.set_state(UserStates.waiting_for_mavzular)
     await message.answer(
         "7️⃣ <b>Siz qanday mavzularda kontent chiqarishni hoxlayapsiz?</b>\n"
@@ -347,7 +401,7 @@ async def process_tajriba(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_mavzular)
 async def process_mavzular(message: Message, state: FSMContext):
-    await state.update_data(mavzular=message.text)
+    await state.update_data(mavzular=pack_text(message.text))
     await state.set_state(UserStates.waiting_for_unique)
     await message.answer(
         "8️⃣ <b>Sizni boshqalardan nima ajratib turadi?</b>\n"
@@ -357,30 +411,16 @@ async def process_mavzular(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_unique)
 async def process_unique(message: Message, state: FSMContext):
-    await state.update_data(unique=message.text)
+    await state.update_data(unique=pack_text(message.text))
     data = await state.get_data()
     
-    soha = data.get('soha')
-    auditoriya = data.get('auditoriya')
-    maqsad = data.get('maqsad')
-    muammolar = data.get('muammolar')
-    tasir = data.get('tasir')
-    tajriba = data.get('tajriba')
-    mavzular = data.get('mavzular')
-    unique = message.text
-
     await message.answer("⏳ <b>Tahlil qilyapman...</b>\nInstagram algoritmlarini o'rganib, eng trenddagi mavzularni tayyorlayapman.")
     await bot.send_chat_action(message.chat.id, "typing")
 
+    answers = _questionnaire_context(data)
+    soha = unpack_text(data.get('soha')) or ""
     prompt = (
-        f"Soha: {soha}\n"
-        f"Auditoriya: {auditoriya}\n"
-        f"Maqsad: {maqsad}\n"
-        f"Hal qilayotgan muammolar: {muammolar}\n"
-        f"Ta'siri: {tasir}\n"
-        f"Shaxsiy tajriba/Keyslar: {tajriba}\n"
-        f"Istalgan mavzular: {mavzular}\n"
-        f"O'ziga xoslik (USP): {unique}\n\n"
+        answers +
         "🎯 TOPSHIRIQ:\n"
         "Yuqoridagi barcha ma'lumotlardan kelib chiqib, Instagram Reels uchun ROPPA-ROSA 15 TA (kam ham emas, ko'p ham emas) viral mavzu va HeyGen avatari gapirishi uchun tayyor matn (skript) yozing.\n\n"
         "Talablar:\n"
@@ -393,20 +433,17 @@ async def process_unique(message: Message, state: FSMContext):
         "Barcha javoblar O'zbek tilida bo'lsin."
     )
 
-    response_text = await _send_to_chatgpt(prompt)
-    
-    # Save the response for refinement
-    await state.update_data(last_response=response_text)
+    # Одинаковые (и почти одинаковые в той же сфере) анкеты берутся из кэша без запроса к ChatGPT
+    cached_response = None
+    if config.LLM_CACHE_ENABLED:
+        cached_response = llm_cache.get(prompt, config.OPENAI_MODEL, near_text=answers, scope=soha)
+    scenarios, response_text = await _generate_and_send(message, prompt, cached_response)
+    # Кэшируется только полный ответ: без ошибки потока и без обрезки по max_tokens
+    if config.LLM_CACHE_ENABLED and cached_response is None and response_text and len(scenarios) == SCENARIO_COUNT:
+        llm_cache.put(prompt, response_text, config.OPENAI_MODEL, near_text=answers, scope=soha)
     
-    # Split and send response
-    response_parts = _split_text_by_scenarios(response_text)
-    for i, part in enumerate(response_parts):
-        try:
-            await message.answer(part)
-            await asyncio.sleep(0.5)
-        except Exception as e:
-            logger.error(f"Error sending part {i+1}: {e}")
-            continue
+    # Save the parsed scenarios for refinement
+    await state.update_data(scenarios=dump_scenarios(scenarios), gen_context=pack_text(answers))
 
     # Create inline keyboard
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -427,66 +464,32 @@ async def process_unique(message: Message, state: FSMContext):
 
 @dp.message(UserStates.waiting_for_selection)
 async def process_selection(message: Message, state: FSMContext):
-    selected_numbers = message.text
     data = await state.get_data()
-    
-    # Retrieve context
-    soha = data.get('soha')
-    auditoriya = data.get('auditoriya')
-    maqsad = data.get('maqsad')
-    muammolar = data.get('muammolar')
-    tasir = data.get('tasir')
-    tajriba = data.get('tajriba')
-    mavzular = data.get('mavzular')
-    unique = data.get('unique')
-    last_response = data.get('last_response')
+
+    # Kept scenarios stay local; only the replacements are generated
+    previous = index_scenarios(load_scenarios(data.get('scenarios')))
+    kept = {n: previous[n] for n in parse_selection(message.text) if n in previous}
 
     await message.answer("⏳ <b>Qayta ishlayapman...</b>\nTanlangan mavzularni saqlab, qolganlarini yangilayapman.")
     await bot.send_chat_action(message.chat.id, "typing")
 
-    prompt = (
-        f"Soha: {soha}\n"
-        f"Auditoriya: {auditoriya}\n"
-        f"Maqsad: {maqsad}\n"
-        f"Hal qilayotgan muammolar: {muammolar}\n"
-        f"Ta'siri: {tasir}\n"
-        f"Shaxsiy tajriba/Keyslar: {tajriba}\n"
-        f"Istalgan mavzular: {mavzular}\n"
-        f"O'ziga xoslik (USP): {unique}\n\n"
-        "--------------------------------------------------\n"
-        f"OLDINGI GENERATSIYA:\n{last_response}\n"
-        "--------------------------------------------------\n"
-        f"FOYDALANUVCHI TANLAGAN RAQAMLAR: {selected_numbers}\n\n"
-        "🎯 TOPSHIRIQ:\n"
-        "1. Foydalanuvchi tanlagan raqamdagi mavzularni (Hook va Kontent) XUDDI O'ZIDEK saqlab qoling.\n"
-        "2. Tanlanmagan mavzular o'rniga YANGI, viral va qiziqarli g'oyalar yozing.\n"
-        "3. Jami yana ROPPA-ROSA 15 TA kontent bo'lishi kerak (eski saqlanganlar + yangilar = 15 ta).\n\n"
-        "Javobingiz qat'iy quyidagi formatda bo'lsin (har bir mavzu uchun):\n\n"
-        "🎥 Kontent {raqam}\n"
-        "<b>Hook:</b> [Videoni boshlash uchun 3 soniyalik kuchli ilmoq/gap]\n"
-        "<b>Kontent:</b> [Video nima haqida bo'lishi, vizual tavsif va g'oya]\n\n"
-        "Barcha javoblar O'zbek tilida bo'lsin."
-    )
+    def on_ready(scenario: Scenario) -> None:
+        # Сценарии уходят в чат по мере готовности, как при первой генерации
+        for part in _scenario_parts(scenario.render()):
+            outbox.enqueue(message.chat.id, part)
 
-    response_text = await _send_to_chatgpt(prompt)
+    # Контекст первой генерации: ответы анкеты или расшифровка голосового
+    context = unpack_text(data.get('gen_context')) or _questionnaire_context(data)
+    try:
+        scenarios = await _regenerate_scenarios(context, kept, on_ready=on_ready)
+    except Exception as e:
+        logger.error(f"ChatGPT API xatoligi: {e}")
+        await message.answer(f"❌ ChatGPT bilan bog'lanishda xatolik: {str(e)}")
+        return
     
-    # Update last response
-    await state.update_data(last_response=response_text)
-
-    # Split and send response
-    response_parts = _split_text_by_scenarios(response_text)
-    for i, part in enumerate(response_parts):
-        try:
-            await message.answer(part)
-            await asyncio.sleep(0.5)
-        except Exception as e:
-            logger.error(f"Error sending part {i+1}: {e}")
-            continue
-            
-    # Create inline keyboard
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Hammasi yoqdi", callback_data="finish_generation")]
-    ])
+    # Update saved scenarios
+    await state.update_data(scenarios=dump_scenarios(scenarios))
+    await outbox.flush(message.chat.id)
 
     await message.answer(
         "\n♻️ <b>Yana o'zgartiramizmi?</b>\n"
@@ -494,18 +497,86 @@ async def process_selection(message: Message, state: FSMContext):
     )
 
 
+# Регистрируется до общего handle_audio_message, иначе тот перехватит голосовое
+@dp.message(UserStates.waiting_for_audio, F.voice | F.audio)
+async def process_audio(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    timestamp = int(time.time())
+    random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
+    
+    # Determine file extension and file id
+    if message.voice:
+        file_id = message.voice.file_id
+        file_ext = "ogg"
+    else:
+        file_id = message.audio.file_id
+        file_ext = "mp3"  # Default to mp3 for audio files, or extract from file_name if needed
+        if message.audio.file_name:
+            ext = message.audio.file_name.split('.')[-1]
+            if ext:
+                file_ext = ext
+
+    filename = f"{user_id}_{timestamp}_{random_suffix}.{file_ext}"
+    
+    # Аудио для HeyGen хранится отдельно и удаляется по сроку (storage_manager)
+    file_path = storage_manager.upload_path(filename)
+    
+    try:
+        file = await bot.get_file(file_id)
+        await bot.download_file(file.file_path, file_path)
+        
+        # Save audio file path in state
+        await state.update_data(audio_file_path=file_path)
+        
+        await message.answer(
+            f"✅ Audio qabul qilindi va saqlandi!\n"
+            f"Fayl nomi: {filename}\n\n"
+            "⏳ Avatarlar yuklanmoqda..."
+        )
+        await bot.send_chat_action(message.chat.id, "typing")
+        
+        # Avatars come from the shared catalog cache, not from HeyGen on every request
+        if not config.HEYGEN_API_KEY:
+            await message.answer("❌ HeyGen API kaliti topilmadi! Iltimos, admin bilan bog'laning.")
+            await state.set_state(UserStates.waiting_for_scenario_number)
+            return
+        
+        catalog = await avatar_catalog.get()
+        
+        if not catalog:
+            await message.answer("❌ Avatarlarni yuklashda xatolik. Iltimos, qaytadan urinib ko'ring.")
+            await state.set_state(UserStates.waiting_for_scenario_number)
+            return
+        
+        if not catalog.avatars:
+            await message.answer("❌ Hech qanday avatar topilmadi.")
+            await state.set_state(UserStates.waiting_for_scenario_number)
+            return
+        
+        # Paginated inline picker over the whole catalog; pages are rendered from the shared snapshot
+        await send_picker(message, state, catalog)
+        await state.set_state(UserStates.waiting_for_avatar)
+        
+    except Exception as e:
+        logger.error(f"Error saving audio: {e}")
+        await message.answer("❌ Audio saqlashda xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.")
+
+
 @dp.message(F.voice | F.audio)
 async def handle_audio_message(message: Message, state: FSMContext):
     await bot.send_chat_action(message.chat.id, "typing")
 
     file_id: Optional[str] = None
+    file_unique_id: Optional[str] = None
     file_size: Optional[int] = None
     
     if message.voice:
         file_id = message.voice.file_id
+        file_unique_id = message.voice.file_unique_id
         file_size = message.voice.file_size
     elif message.audio:
         file_id = message.audio.file_id
+        file_unique_id = message.audio.file_unique_id
         file_size = message.audio.file_size
 
     if not file_id:
@@ -524,120 +595,14 @@ async def handle_audio_message(message: Message, state: FSMContext):
             logger.warning(f"File too large: {file_size_mb:.1f} MB (limit: {MAX_FILE_SIZE_MB} MB)")
             return
 
-    # Создаем временную папку для этого аудио
-    temp_dir = None
-    src_path = None
-    
-    try:
-        tg_file = await bot.get_file(file_id)
-        src_ext = os.path.splitext(tg_file.file_path or "")[1] or ".ogg"
-        rnd = uuid.uuid4().hex
-        
-        # Создаем уникальную папку для каждого аудио в постоянном хранилище
-        temp_dir = os.path.join(AUDIO_STORAGE_DIR, f"audio_{rnd}")
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        src_path = os.path.join(temp_dir, f"original{src_ext}")
-        wav_path = os.path.join(temp_dir, "full.wav")
-
-        # Скачиваем оригинал
-        await bot.download_file(tg_file.file_path, destination=src_path)
-
-        # Конвертируем в WAV 16кГц моно
-        _run_ffmpeg_to_wav(src_path, wav_path)
-
-        # Разрезаем на куски по 48 секунд (если нужно)
-        chunk_paths = _split_audio_to_chunks(wav_path, temp_dir)
-        
-        # Обрабатываем каждый кусок через STT
-        all_texts = []
-        for i, chunk_path in enumerate(chunk_paths):
-            try:
-                form_filename = f"{uuid.uuid4().hex}.wav"
-                text_result = _post_to_stt(chunk_path, form_filename)
-                if text_result and text_result.strip():
-                    all_texts.append(text_result.strip())
-                    logger.info(f"Chunk {i+1}/{len(chunk_paths)} processed: {len(text_result)} chars")
-                else:
-                    logger.warning(f"Chunk {i+1}/{len(chunk_paths)} вернул пустой результат")
-            except Exception as chunk_error:
-                logger.error(f"Ошибка при обработке куска {i+1}/{len(chunk_paths)}: {chunk_error}")
-                # Продолжаем обработку следующих кусков
-                continue
-
-        # Объединяем все тексты
-        combined_text = " ".join(all_texts)
-        
-        if not combined_text:
-            await message.answer("Tanish natijasi bo'sh. Yana urinib ko'ring.")
-        else:
-            # Сохраняем распознанный текст в файл
-            text_file_path = os.path.join(temp_dir, "stt_text.txt")
-            try:
-                with open(text_file_path, "w", encoding="utf-8") as text_file:
-                    text_file.write(combined_text)
-                logger.info(f"STT текст сохранен в: {text_file_path}")
-            except Exception as e:
-                logger.error(f"Ошибка при сохранении текста: {e}")
-            
-            # Отправляем распознанный текст пользователю
-            await message.answer("📝 Tanish natijalari:\n" + "="*30)
-            text_parts = _split_text_for_telegram(combined_text)
-            for i, part in enumerate(text_parts):
-                try:
-                    if i == 0:
-                        await message.answer(part)
-                    else:
-                        await message.answer(f"[{i+1}/{len(text_parts)}] {part}")
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке части текста {i+1}: {e}")
-                    continue
-            
-            # Отправляем в ChatGPT с промптом
-            await message.answer("\n🤖 ChatGPT bilan kontent plan tayyorlanmoqda...")
-            await bot.send_chat_action(message.chat.id, "typing")
-            
-            prompt = (
-                f"Mijozning audio xabari matni: {combined_text}\n\n"
-                "🎯 TOPSHIRIQ:\n"
-                "Yuqoridagi audio matnidan kelib chiqib, Instagram Reels uchun 15 ta viral mavzu yozing.\n\n"
-                "Javobingiz qat'iy quyidagi formatda bo'lsin (har bir mavzu uchun):\n\n"
-                "🎥 Kontent {raqam}\n"
-                "<b>Hook:</b> [Videoni boshlash uchun 3 soniyalik kuchli ilmoq/gap]\n"
-                "<b>Kontent:</b> [Video nima haqida bo'lishi, vizual tavsif va g'oya]\n\n"
-                "Barcha javoblar O'zbek tilida bo'lsin."
-            )
-            
-            response_text = await _send_to_chatgpt(prompt)
-            
-            # Save for refinement
-            await state.update_data(last_response=response_text)
-            
-            # Split and send response
-            response_parts = _split_text_for_telegram(response_text)
-            for i, part in enumerate(response_parts):
-                try:
-                    await message.answer(part)
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке ответа ChatGPT {i+1}: {e}")
-                    continue
-            
-            await state.set_state(UserStates.waiting_for_selection)
-            await message.answer(
-                "\n♻️ <b>Qaysi mavzular sizga yoqdi?</b>\n\n"
-                "Yoqqan mavzular raqamini yozing (masalan: 1, 5, 10).\n"
-                "Men ularni saqlab qolaman va qolganlarini yangisiga almashtirib beraman.\n\n"
-                "Yoki yangi soha tanlash uchun /start ni bosing."
-            )
-            
-    except Exception as e:
-        logger.error(f"STT error: {e}", exc_info=True)
-        await message.answer("Audio qayta ishlashda xatolik yuz berdi.")
-    finally:
-        if temp_dir and os.path.exists(temp_dir):
-            logger.info(f"Аудио и текст сохранены в: {temp_dir}")
+    # Дальше работает конвейер: скачивание, ffmpeg, STT и ChatGPT идут в фоне
+    # с сохранением каждого этапа, результат придёт отдельными сообщениями
+    ahead = await audio_pipeline.submit(message.chat.id, message.from_user.id, file_id, file_unique_id,
+                                        state=await state.get_state())
+    queued_text = "⏳ Audio qabul qilindi, qayta ishlanmoqda..."
+    if ahead:
+        queued_text += f"\nNavbatda sizdan oldin: {ahead}"
+    await message.answer(queued_text)
 
 
 
@@ -656,12 +621,11 @@ async def process_scenario_number(message: Message, state: FSMContext):
         
         # Extract scenario text
         data = await state.get_data()
-        last_response = data.get('last_response', '')
-        scenario_text = _extract_scenario(last_response, selection)
+        scenario = index_scenarios(load_scenarios(data.get('scenarios'))).get(selection)
         
         msg_text = f"✅ {selection}-mavzu tanlandi.\n\n"
-        if scenario_text:
-            msg_text += f"{scenario_text}\n\n"
+        if scenario:
+            msg_text += f"{scenario.render()}\n\n"
         
         msg_text += "Endi ushbu mavzu uchun audio yozib yuboring (ovozli xabar yoki audio fayl)."
         
@@ -672,139 +636,113 @@ async def process_scenario_number(message: Message, state: FSMContext):
         await message.answer("Iltimos, faqat raqam yozing. Masalan: 1")
 
 
-@dp.message(UserStates.waiting_for_audio, F.voice | F.audio)
-async def process_audio(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    timestamp = int(time.time())
-    random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
-    
-    # Determine file extension and file id
-    if message.voice:
-        file_id = message.voice.file_id
-        file_ext = "ogg"
-    else:
-        file_id = message.audio.file_id
-        file_ext = "mp3"  # Default to mp3 for audio files, or extract from file_name if needed
-        if message.audio.file_name:
-            ext = message.audio.file_name.split('.')[-1]
-            if ext:
-                file_ext = ext
+@dp.message(UserStates.waiting_for_avatar)
+async def process_avatar_selection(message: Message, state: FSMContext):
+    """Handle avatar typed as text: exact name selects it, anything else searches by name prefix"""
+    picked = await pick_by_text(message, state)
+    if picked is not None:
+        await _avatar_selected(message, state, *picked)
 
-    filename = f"{user_id}_{timestamp}_{random_suffix}.{file_ext}"
-    
-    # Ensure storage directory exists
-    os.makedirs("audio_storage", exist_ok=True)
-    file_path = os.path.join("audio_storage", filename)
-    
-    try:
-        file = await bot.get_file(file_id)
-        await bot.download_file(file.file_path, file_path)
-        
-        # Save audio file path in state
-        await state.update_data(audio_file_path=file_path)
-        
-        await message.answer(
-            f"✅ Audio qabul qilindi va saqlandi!\n"
-            f"Fayl nomi: {filename}\n\n"
-            "⏳ Avatarlar yuklanmoqda..."
-        )
-        await bot.send_chat_action(message.chat.id, "typing")
-        
-        # Fetch avatars from HeyGen
-        heygen_api_key = config.HEYGEN_API_KEY
-        
-        if not heygen_api_key:
-            await message.answer("❌ HeyGen API kaliti topilmadi! Iltimos, admin bilan bog'laning.")
-            await state.set_state(UserStates.waiting_for_scenario_number)
-            return
-        
-        creator = HeyGenVideoCreator(heygen_api_key)
-        avatars = creator.get_avatars()
-        
-        if not avatars:
-            await message.answer("❌ Avatarlarni yuklashda xatolik. Iltimos, qaytadan urinib ko'ring.")
-            await state.set_state(UserStates.waiting_for_scenario_number)
-            return
-        
-        # Filter avatars with valid names and limit to first 50
-        valid_avatars = [av for av in avatars if av.get('name')][:50]
-        
-        if not valid_avatars:
-            await message.answer("❌ Hech qanday avatar topilmadi.")
-            await state.set_state(UserStates.waiting_for_scenario_number)
-            return
-        
-        # Create avatar mapping
-        avatar_map = {}
-        keyboard_buttons = []
-        
-        for av in valid_avatars:
-            name = av.get('name', 'Unknown')
-            avatar_id = av.get('avatar_id')
-            avatar_map[name] = avatar_id
-            keyboard_buttons.append([KeyboardButton(text=name)])
-        
-        # Store avatar map in state
-        await state.update_data(avatar_map=avatar_map)
-        
-        # Create keyboard
-        from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-        keyboard = ReplyKeyboardMarkup(keyboard=keyboard_buttons, resize_keyboard=True)
-        
-        await message.answer(
-            "👤 Avatarni tanlang:",
-            reply_markup=keyboard
-        )
-        await state.set_state(UserStates.waiting_for_avatar)
-        
-    except Exception as e:
-        logger.error(f"Error saving audio: {e}")
-        await message.answer("❌ Audio saqlashda xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.")
 
+@dp.callback_query(AvatarPage.filter(), UserStates.waiting_for_avatar)
+async def process_avatar_page(callback: CallbackQuery, callback_data: AvatarPage, state: FSMContext):
+    await turn_page(callback, callback_data, state)
 
-@dp.message(UserStates.waiting_for_avatar)
-async def process_avatar_selection(message: Message, state: FSMContext):
-    """Handle avatar selection after audio upload"""
-    data = await state.get_data()
-    avatar_map = data.get('avatar_map', {})
-    
-    selected_name = message.text
-    avatar_id = avatar_map.get(selected_name)
-    
-    if not avatar_id:
-        await message.answer("❌ Iltimos, ro'yxatdan avatarni tanlang.")
-        return
-    
+
+@dp.callback_query(AvatarChoice.filter(), UserStates.waiting_for_avatar)
+async def process_avatar_choice(callback: CallbackQuery, callback_data: AvatarChoice, state: FSMContext):
+    picked = await pick(callback, callback_data, state)
+    if picked is not None:
+        await _avatar_selected(callback.message, state, *picked)
+
+
+async def _avatar_selected(message: Message, state: FSMContext, avatar_id: str, name: str) -> None:
     # Save selected avatar
-    await state.update_data(selected_avatar_id=avatar_id, selected_avatar_name=selected_name)
-    
-    from aiogram.types import ReplyKeyboardRemove
+    await state.update_data(selected_avatar_id=avatar_id, selected_avatar_name=name)
     await message.answer(
-        f"✅ Avatar tanlandi: {selected_name}\n\n"
+        f"✅ Avatar tanlandi: {html.escape(name)}\n\n"
         "Video yaratish uchun barcha ma'lumotlar tayyor!\n"
         "Yana boshqa mavzu tanlash uchun raqamini yozing yoki "
-        "yangi soha uchun /start ni bosing.",
-        reply_markup=ReplyKeyboardRemove()
+        "yangi soha uchun /start ni bosing."
     )
     
     # Return to scenario selection
     await state.set_state(UserStates.waiting_for_scenario_number)
 
 
-@dp.message()
+# Обработчики самого dp проверяются раньше вложенных роутеров, поэтому запасной
+# обработчик - в своём роутере, подключённом после heygen_router
+fallback_router = Router(name="fallback")
+dp.include_router(fallback_router)
+
+
+@fallback_router.message()
 async def default_message(message: Message, state: FSMContext):
     await message.answer(
         "Iltimos, /start buyrug'ini bosing va so'rovnomani to'ldiring."
     )
 
 
+async def _health() -> Dict[str, bool]:
+    """Живость процесса для /health: пульс event loop, воркеры конвейера, FSM хранилище"""
+    checks = {"pipeline": audio_pipeline.alive()}
+    if loop_monitor is not None:
+        checks["loop"] = loop_monitor.alive()
+    if config.FSM_STORAGE == "postgres":
+        try:
+            await asyncio.wait_for(storage.ping(), timeout=3)
+            checks["storage"] = True
+        except Exception as e:
+            logger.error(f"FSM хранилище недоступно: {e}")
+            checks["storage"] = False
+    return checks
+
+
 async def main():
     logging.info("Bot ishga tushmoqda...")
+    await http_clients.startup()
+    if loop_monitor is not None:
+        loop_monitor.start()
+    video_tracker.start(bot)
+    avatar_catalog.warm()
+    audio_pipeline.start(config.PIPELINE_WORKERS)
+    storage_manager.start()
+    session_janitor.start()
+    metrics_server = MetricsServer(config.METRICS_HOST, config.METRICS_PORT, health=_health) if config.METRICS_PORT else None
+    if metrics_server is not None:
+        await metrics_server.start()
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        if config.BOT_MODE == "webhook":
+            await run_webhook(
+                dp, bot,
+                base_url=config.WEBHOOK_BASE_URL,
+                path=config.WEBHOOK_PATH,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                secret=config.WEBHOOK_SECRET,
+                workers=config.UPDATE_WORKERS,
+                max_pending=config.UPDATE_QUEUE_SIZE,
+                per_chat_limit=config.PER_CHAT_CONCURRENCY,
+            )
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
     finally:
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await session_janitor.stop()
+        await storage_manager.stop()
+        await audio_pipeline.stop()
+        await stt_cache.flush()
+        await video_tracker.stop()
+        logging.info(f"Медиа-исполнитель: {media_executor.stats()}")
+        await media_executor.shutdown()
+        await llm_client.close()
+        await http_clients.shutdown()
+        await storage.close()
         await bot.session.close()
+        if loop_monitor is not None:
+            await loop_monitor.stop()
 
 
 if __name__ == "__main__":
@@ -6,19 +6,114 @@ load_dotenv()
 
 # Telegram Bot Token
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Свой Bot API сервер (local bot-api, нагрузочный тест); пусто - api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
 
 # Язык ответов (используется в приветствии и подсказках)
 BOT_LANGUAGE = os.getenv('BOT_LANGUAGE', 'uz')
 
 # OpenAI API настройки
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+# Другой адрес OpenAI-совместимого API (прокси, нагрузочный тест); пусто - api.openai.com
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+# Сколько запросов к OpenAI одновременно допускается в одном процессе
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '4'))
+# Таймаут одного запроса к OpenAI (секунды)
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '120'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+# Отправлять сценарии пользователю по мере генерации (stream=True)
+OPENAI_STREAMING = os.getenv('OPENAI_STREAMING', '1').lower() in ('1', 'true', 'yes')
+# При доработке сценариев новые генерируются параллельными запросами по N штук
+REGEN_BATCH_SIZE = int(os.getenv('REGEN_BATCH_SIZE', '5'))
 
 # Настройки STT (Muxlisa)
 MUXLISA_STT_URL = os.getenv('MUXLISA_STT_URL', 'https://service.muxlisa.uz/api/v2/stt')
 MUXLISA_API_KEY = os.getenv('MUXLISA_API_KEY')
+# Сколько кусков аудио отправлять в STT одновременно
+STT_MAX_IN_FLIGHT = int(os.getenv('STT_MAX_IN_FLIGHT', '4'))
+STT_READ_TIMEOUT = float(os.getenv('STT_READ_TIMEOUT', '120'))
+# Кэш результатов STT (по хэшу аудио / file_unique_id)
+STT_CACHE_MAX_ENTRIES = int(os.getenv('STT_CACHE_MAX_ENTRIES', '1000'))
+STT_CACHE_MAX_MB = int(os.getenv('STT_CACHE_MAX_MB', '50'))
+STT_CACHE_MAX_AGE_DAYS = int(os.getenv('STT_CACHE_MAX_AGE_DAYS', '30'))
 
 # HeyGen API настройки
 HEYGEN_API_KEY = os.getenv('HEYGEN_API_KEY')
+HEYGEN_TIMEOUT = float(os.getenv('HEYGEN_TIMEOUT', '60'))
+HEYGEN_MAX_CONNECTIONS = int(os.getenv('HEYGEN_MAX_CONNECTIONS', '10'))
+
+# Общие настройки HTTP пулов (STT, HeyGen)
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '30'))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))
+# HTTP/2 используется, только если установлен пакет h2
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', '1').lower() in ('1', 'true', 'yes')
+
+# Лимиты исходящих сообщений Telegram (сообщений в секунду)
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', '30'))
+TG_CHAT_RATE = float(os.getenv('TG_CHAT_RATE', '1'))
+TG_CHAT_BURST = float(os.getenv('TG_CHAT_BURST', '3'))
+
+# Медиа-процессы (ffmpeg): сколько одновременно (0 = по числу ядер) и таймаут одного процесса
+MEDIA_MAX_PROCESSES = int(os.getenv('MEDIA_MAX_PROCESSES', '0'))
+MEDIA_PROCESS_TIMEOUT = float(os.getenv('MEDIA_PROCESS_TIMEOUT', '300'))
+
+# Конвейер голосовых сообщений: воркеров в процессе бота (0 = только pipeline_worker.py),
+# число попыток этапа и аренда задания (секунды) - после неё задание подхватит другой воркер;
+# завершённые задания хранятся PIPELINE_RETENTION_HOURS часов
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '2'))
+PIPELINE_MAX_ATTEMPTS = int(os.getenv('PIPELINE_MAX_ATTEMPTS', '3'))
+PIPELINE_LEASE = float(os.getenv('PIPELINE_LEASE', '900'))
+PIPELINE_RETENTION_HOURS = float(os.getenv('PIPELINE_RETENTION_HOURS', '168'))
+
+# Кэш ответов ChatGPT на анкету: размер, срок жизни (часы) и допустимое
+# расстояние SimHash для почти одинаковых анкет (0 - только точное совпадение)
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '500'))
+LLM_CACHE_TTL_HOURS = float(os.getenv('LLM_CACHE_TTL_HOURS', '24'))
+LLM_CACHE_NEAR_DISTANCE = int(os.getenv('LLM_CACHE_NEAR_DISTANCE', '3'))
+
+# Хранение audio_storage: срок жизни оригиналов и аудио для HeyGen (дни),
+# квота на всё аудио (MB) и интервал фоновой очистки (секунды)
+# Папка audio_storage (по умолчанию - рядом с bot.py)
+AUDIO_STORAGE_DIR = os.getenv('AUDIO_STORAGE_DIR', '')
+STORAGE_ORIGINAL_MAX_AGE_DAYS = float(os.getenv('STORAGE_ORIGINAL_MAX_AGE_DAYS', '7'))
+STORAGE_UPLOAD_MAX_AGE_DAYS = float(os.getenv('STORAGE_UPLOAD_MAX_AGE_DAYS', '3'))
+STORAGE_MAX_MB = int(os.getenv('STORAGE_MAX_MB', '2048'))
+STORAGE_SWEEP_INTERVAL = float(os.getenv('STORAGE_SWEEP_INTERVAL', '3600'))
+
+# FSM сессии: удаление простаивающих дольше SESSION_IDLE_HOURS (0 - не удалять), интервал обхода (секунды)
+SESSION_IDLE_HOURS = float(os.getenv('SESSION_IDLE_HOURS', '72'))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '600'))
+
+# Метрики Prometheus (/metrics) и /health для Docker HEALTHCHECK; METRICS_PORT=0 - выключено
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
+# Сторож event loop: блокировки дольше порога (секунды) попадают в лог со стеком и в метрики; 0 - выключено
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.1'))
+
+# FSM хранилище: memory (по умолчанию) или postgres (общее для нескольких воркеров)
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory').lower()
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = int(os.getenv('POSTGRES_PORT', '5432'))
+POSTGRES_USER = os.getenv('POSTGRES_USER', 'postgres')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', '')
+POSTGRES_DB = os.getenv('POSTGRES_DB', 'impulse_bot')
+POSTGRES_POOL_MIN = int(os.getenv('POSTGRES_POOL_MIN', '1'))
+POSTGRES_POOL_MAX = int(os.getenv('POSTGRES_POOL_MAX', '10'))
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Пул обработчиков апдейтов в webhook режиме
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '16'))
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+PER_CHAT_CONCURRENCY = int(os.getenv('PER_CHAT_CONCURRENCY', '1'))
 
 # Проверка наличия необходимых переменных
 if not TELEGRAM_BOT_TOKEN:
@@ -29,3 +124,6 @@ if not OPENAI_API_KEY:
 
 if not MUXLISA_API_KEY:
     raise ValueError("MUXLISA_API_KEY не найден в переменных окружения")
+
+if BOT_MODE == 'webhook' and not WEBHOOK_BASE_URL:
+    raise ValueError("WEBHOOK_BASE_URL обязателен при BOT_MODE=webhook")
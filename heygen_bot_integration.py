@@ -5,7 +5,10 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKey
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from heygen_video import HeyGenVideoCreator
+from heygen_client import HeyGenClient
+from video_jobs import VideoJobTracker
+from avatar_catalog import AvatarChoice, AvatarPage, avatar_catalog, pick, pick_by_text, send_picker, turn_page
+from session_store import pack_text, unpack_text
 
 # Initialize router
 router = Router()
@@ -21,6 +24,33 @@ class VideoCreationStates(StatesGroup):
 UZ = True  # Assuming Uzbek based on bot.py context, or we can make it dynamic if needed. 
 # For now, I'll keep the logic from the snippet but clean it up.
 
+
+async def _notify_video_result(bot: Bot, job: dict, result: str):
+    """Сообщает пользователю о завершении рендера (вызывается из VideoJobTracker)"""
+    if result == "completed":
+        video_url = job.get("video_url", "")
+        text = (
+            f"🎉 Video tayyor!\n\n"
+            f"📥 Yuklab olish: {video_url}"
+            if UZ else
+            f"🎉 Видео готово!\n\n"
+            f"📥 Скачать: {video_url}"
+        )
+    else:
+        text = (
+            "❌ Video yaratishda xatolik yuz berdi."
+            if UZ else
+            "❌ Ошибка при создании видео."
+        )
+    await bot.send_message(job["chat_id"], text)
+
+
+# Отслеживание рендеров в фоне; запускается из bot.main()
+video_tracker = VideoJobTracker(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "video_jobs.json"),
+    notify=_notify_video_result,
+)
+
 @router.message(Command("createvideo"))
 async def cmd_create_video(message: Message, state: FSMContext):
     """Начало создания видео с аватаром"""
@@ -38,76 +68,49 @@ async def cmd_create_video(message: Message, state: FSMContext):
 @router.message(VideoCreationStates.script)
 async def process_video_script(message: Message, state: FSMContext):
     """Обработка скрипта для видео и получение списка аватаров"""
-    await state.update_data(script=message.text)
+    await state.update_data(script=pack_text(message.text))
     
     await message.answer("⏳ Avatarlar yuklanmoqda..." if UZ else "⏳ Загрузка аватаров...")
     await message.bot.send_chat_action(message.chat.id, "typing")
     
-    # Fetch avatars
-    api_key = os.getenv('HEYGEN_API_KEY')
-    if not api_key:
+    # Avatars come from the shared catalog cache
+    if not os.getenv('HEYGEN_API_KEY'):
         await message.answer("❌ API key not found")
         return
 
-    creator = HeyGenVideoCreator(api_key)
-    avatars = creator.get_avatars()
+    catalog = await avatar_catalog.get()
     
-    if not avatars:
+    if not catalog or not catalog.avatars:
         await message.answer("❌ Avatarlarni yuklashda xatolik" if UZ else "❌ Ошибка загрузки аватаров")
         return
 
-    # Store avatars in state to use later
-    # We'll store a simplified list or dict
-    # avatars is a list of dicts
-    
-    # Filter or just take top N? Or show all?
-    # Let's show first 10-15 or use pagination if needed. 
-    # For now, let's just list names.
-    
-    # Create buttons
-    keyboard_builder = []
-    
-    # Save mapping of Name -> ID in state
-    avatar_map = {}
-    
-    for av in avatars:
-        name = av.get('name', 'Unknown')
-        aid = av.get('avatar_id')
-        preview = av.get('preview_image_url') # Optional: could send preview
-        
-        # Make name unique if needed, but usually names are distinct enough or we use ID
-        # Let's use Name in button
-        avatar_map[name] = aid
-        keyboard_builder.append([KeyboardButton(text=name)])
-        
-    await state.update_data(avatar_map=avatar_map)
-    
-    keyboard = ReplyKeyboardMarkup(keyboard=keyboard_builder, resize_keyboard=True)
-    
-    text = (
-        "👤 Avatarni tanlang:"
-        if UZ else
-        "👤 Выберите аватар:"
-    )
-    await message.answer(text, reply_markup=keyboard)
+    # Inline picker with pages and search; only the catalog version goes to the state
+    await send_picker(message, state, catalog)
     await state.set_state(VideoCreationStates.avatar)
 
 
 @router.message(VideoCreationStates.avatar)
 async def process_video_avatar(message: Message, state: FSMContext):
-    """Обработка выбора аватара"""
-    data = await state.get_data()
-    avatar_map = data.get('avatar_map', {})
-    
-    selected_name = message.text
-    avatar_id = avatar_map.get(selected_name)
-    
-    if not avatar_id:
-        # Try fuzzy match or just error
-        # Let's try to find if user typed something close or just error
-        await message.answer("❌ Iltimos, ro'yxatdan tanlang" if UZ else "❌ Пожалуйста, выберите из списка")
-        return
-    
+    """Аватар текстом: точное имя - выбор, иначе поиск по началу имени"""
+    picked = await pick_by_text(message, state)
+    if picked is not None:
+        await _ask_voice(message, state, picked[0])
+
+
+@router.callback_query(AvatarPage.filter(), VideoCreationStates.avatar)
+async def process_video_avatar_page(callback: CallbackQuery, callback_data: AvatarPage, state: FSMContext):
+    await turn_page(callback, callback_data, state)
+
+
+@router.callback_query(AvatarChoice.filter(), VideoCreationStates.avatar)
+async def process_video_avatar_choice(callback: CallbackQuery, callback_data: AvatarChoice, state: FSMContext):
+    picked = await pick(callback, callback_data, state)
+    if picked is not None:
+        await _ask_voice(callback.message, state, picked[0])
+
+
+async def _ask_voice(message: Message, state: FSMContext, avatar_id: str):
+    """Аватар выбран - выбор голоса"""
     await state.update_data(avatar_id=avatar_id)
     
     # Voice selection
@@ -188,11 +191,11 @@ async def process_video_voice(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        creator = HeyGenVideoCreator(heygen_api_key)
+        client = HeyGenClient(heygen_api_key)
         
         # Создаем видео
-        result = creator.create_video(
-            script_text=data['script'],
+        result = await client.create_video(
+            script_text=unpack_text(data['script']),
             avatar_id=data['avatar_id'],
             voice_id=data['voice_id']
         )
@@ -200,38 +203,19 @@ async def process_video_voice(message: Message, state: FSMContext):
         if result and result.get('data'):
             video_id = result['data'].get('video_id')
             
+            # Статус проверяется в фоне, ссылка придёт отдельным сообщением
+            video_tracker.submit(video_id, message.chat.id)
+            
             progress_text = (
                 f"✅ Video yaratilmoqda!\n"
                 f"🆔 Video ID: {video_id}\n\n"
-                f"⏳ Iltimos, kuting..."
+                f"⏳ Video tayyor bo'lganda havolani yuboraman."
                 if UZ else
                 f"✅ Видео создается!\n"
                 f"🆔 Video ID: {video_id}\n\n"
-                f"⏳ Пожалуйста, подождите..."
+                f"⏳ Пришлю ссылку, когда видео будет готово."
             )
             await message.answer(progress_text)
-            
-            # Ожидаем завершения
-            final_status = creator.wait_for_video(video_id, max_wait_time=300)
-            
-            if final_status and final_status.get('data', {}).get('status') == 'completed':
-                video_url = final_status['data'].get('video_url', '')
-                
-                success_text = (
-                    f"🎉 Video tayyor!\n\n"
-                    f"📥 Yuklab olish: {video_url}"
-                    if UZ else
-                    f"🎉 Видео готово!\n\n"
-                    f"📥 Скачать: {video_url}"
-                )
-                await message.answer(success_text)
-            else:
-                error_text = (
-                    "❌ Video yaratishda xatolik yuz berdi."
-                    if UZ else
-                    "❌ Ошибка при создании видео."
-                )
-                await message.answer(error_text)
         else:
             error_text = (
                 "❌ Video yaratish boshlanmadi."
@@ -0,0 +1,66 @@
+import logging
+from typing import List, Optional
+
+import httpx
+
+import http_clients
+import metrics
+from heygen_video import HEYGEN_API_URL, HEYGEN_AVATARS_URL, HEYGEN_STATUS_URL, build_video_payload
+
+logger = logging.getLogger(__name__)
+
+
+class HeyGenClient:
+    """
+    Асинхронный клиент HeyGen для бота.
+
+    Повторяет методы HeyGenVideoCreator, но работает через общий keep-alive
+    пул http_clients ('heygen'), поэтому не блокирует event loop и не
+    открывает новое TLS соединение на каждый запрос. Объект лёгкий -
+    хранит только заголовки.
+    """
+
+    def __init__(self, api_key: str):
+        self.headers = {
+            "X-Api-Key": api_key,
+            "Content-Type": "application/json"
+        }
+
+    async def create_video(self, script_text: str, avatar_id: str = "default", voice_id: str = "default",
+                           background_color: str = "#FFFFFF") -> Optional[dict]:
+        """Создать видео с аватаром. Возвращает ответ API с video_id или None"""
+        payload = build_video_payload(script_text, avatar_id, voice_id, background_color)
+        try:
+            with metrics.track("heygen_create_video"):
+                response = await http_clients.get_client("heygen").post(HEYGEN_API_URL, headers=self.headers, json=payload)
+                response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Ошибка при создании видео: {e}; детали: {e.response.text}")
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка при создании видео: {e}")
+        return None
+
+    async def get_avatars(self) -> Optional[List[dict]]:
+        """Список доступных аватаров или None при ошибке"""
+        try:
+            with metrics.track("heygen_avatars"):
+                response = await http_clients.get_client("heygen").get(HEYGEN_AVATARS_URL, headers=self.headers)
+                response.raise_for_status()
+            return response.json().get('data', {}).get('avatars', [])
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка при получении аватаров: {e}")
+            return None
+
+    async def check_video_status(self, video_id: str) -> Optional[dict]:
+        """Статус создания видео или None при ошибке"""
+        try:
+            with metrics.track("heygen_status"):
+                response = await http_clients.get_client("heygen").get(
+                    HEYGEN_STATUS_URL, headers=self.headers, params={"video_id": video_id}
+                )
+                response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка при проверке статуса {video_id}: {e}")
+            return None
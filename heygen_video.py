@@ -12,8 +12,41 @@ load_dotenv()
 
 # HeyGen API настройки
 HEYGEN_API_KEY = os.getenv('HEYGEN_API_KEY', '')
-HEYGEN_API_URL = "https://api.heygen.com/v2/video/generate"
-HEYGEN_STATUS_URL = "https://api.heygen.com/v1/video_status.get"
+HEYGEN_BASE_URL = os.getenv('HEYGEN_BASE_URL', 'https://api.heygen.com').rstrip('/')
+HEYGEN_API_URL = f"{HEYGEN_BASE_URL}/v2/video/generate"
+HEYGEN_STATUS_URL = f"{HEYGEN_BASE_URL}/v1/video_status.get"
+HEYGEN_AVATARS_URL = f"{HEYGEN_BASE_URL}/v2/avatars"
+
+
+def build_video_payload(script_text, avatar_id="default", voice_id="default", background_color="#FFFFFF"):
+    """Тело запроса на создание видео (общее для синхронного и асинхронного клиента)"""
+    return {
+        "video_inputs": [
+            {
+                "character": {
+                    "type": "avatar",
+                    "avatar_id": avatar_id,
+                    "avatar_style": "normal"
+                },
+                "voice": {
+                    "type": "text",
+                    "input_text": script_text,
+                    "voice_id": voice_id
+                },
+                "background": {
+                    "type": "color",
+                    "value": background_color
+                }
+            }
+        ],
+        "dimension": {
+            "width": 1920,
+            "height": 1080
+        },
+        "aspect_ratio": "16:9",
+        "test": False  # False для реального создания, True для теста
+    }
+
 
 class HeyGenVideoCreator:
     def __init__(self, api_key):
@@ -36,32 +69,7 @@ class HeyGenVideoCreator:
         Returns:
             dict: Ответ от API с video_id
         """
-        payload = {
-            "video_inputs": [
-                {
-                    "character": {
-                        "type": "avatar",
-                        "avatar_id": avatar_id,
-                        "avatar_style": "normal"
-                    },
-                    "voice": {
-                        "type": "text",
-                        "input_text": script_text,
-                        "voice_id": voice_id
-                    },
-                    "background": {
-                        "type": "color",
-                        "value": background_color
-                    }
-                }
-            ],
-            "dimension": {
-                "width": 1920,
-                "height": 1080
-            },
-            "aspect_ratio": "16:9",
-            "test": False  # False для реального создания, True для теста
-        }
+        payload = build_video_payload(script_text, avatar_id, voice_id, background_color)
         
         try:
             response = requests.post(
@@ -84,11 +92,9 @@ class HeyGenVideoCreator:
         Returns:
             list: Список аватаров или None при ошибке
         """
-        url = "https://api.heygen.com/v2/avatars"
-        
         try:
             response = requests.get(
-                url,
+                HEYGEN_AVATARS_URL,
                 headers=self.headers
             )
             response.raise_for_status()
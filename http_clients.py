@@ -0,0 +1,55 @@
+import importlib.util
+import logging
+from typing import Dict
+
+import httpx
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 включается только если установлен пакет h2 (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Отдельный пул соединений на каждый внешний сервис: (таймаут чтения, макс. соединений)
+_PROFILES = {
+    "stt": (config.STT_READ_TIMEOUT, config.STT_MAX_IN_FLIGHT),
+    "heygen": (config.HEYGEN_TIMEOUT, config.HEYGEN_MAX_CONNECTIONS),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    read_timeout, max_connections = _PROFILES[name]
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=config.HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        http2=config.HTTP2_ENABLED and HTTP2_AVAILABLE,
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Общий keep-alive клиент для сервиса ('stt', 'heygen')"""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _create_client(name)
+    return client
+
+
+async def startup() -> None:
+    """Создаёт пулы соединений при старте бота"""
+    for name in _PROFILES:
+        get_client(name)
+    logger.info(f"HTTP пулы готовы: {', '.join(_PROFILES)} (HTTP/2: {config.HTTP2_ENABLED and HTTP2_AVAILABLE})")
+
+
+async def shutdown() -> None:
+    """Закрывает все пулы соединений при остановке бота"""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
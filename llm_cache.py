@@ -0,0 +1,152 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import metrics
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+SIMHASH_BITS = 64
+# 64 бита делятся на 4 полосы по 16: при расстоянии Хэмминга <= 3 хотя бы одна полоса
+# совпадает точно, поэтому кандидатов ищем по полосам, а не перебором всего кэша
+_BANDS = 4
+_BAND_BITS = SIMHASH_BITS // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+_LOOKUPS = metrics.REGISTRY.register(metrics.Counter(
+    "impulse_llm_cache_lookups_total", "Обращения к кэшу ответов ChatGPT", ["result"]
+))
+
+
+def normalize(text: str) -> str:
+    """Нормализация промпта для точного ключа: регистр и пробелы не важны"""
+    return _SPACE_RE.sub(" ", text.casefold()).strip()
+
+
+def simhash(text: str) -> int:
+    """64-битный SimHash по словам и парам слов текста"""
+    words = _WORD_RE.findall(text.casefold())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def _bands(scope: str, fingerprint: int) -> List[Tuple[str, int, int]]:
+    return [(scope, i, fingerprint >> (i * _BAND_BITS) & _BAND_MASK) for i in range(_BANDS)]
+
+
+class _Entry:
+    __slots__ = ("response", "scope", "fingerprint", "created")
+
+    def __init__(self, response: str, scope: str, fingerprint: Optional[int]):
+        self.response = response
+        self.scope = scope
+        self.fingerprint = fingerprint
+        self.created = time.monotonic()
+
+
+class LlmCache:
+    """
+    Кэш ответов ChatGPT для анкеты.
+
+    Точный ключ - SHA-256 нормализованного промпта. Дополнительно (если
+    передан near_text - ответы пользователя) ищется почти такой же запрос:
+    SimHash ответов с расстоянием Хэмминга не больше near_distance, но
+    только среди запросов с тем же scope (сфера пользователя) - на коротких
+    анкетах SimHash разных сфер может отличаться всего на несколько бит.
+    Вытеснение - LRU до max_entries и TTL. Хранится в памяти процесса.
+    """
+
+    def __init__(self, max_entries: int = 500, ttl: float = 24 * 3600, near_distance: int = 3):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_distance = min(near_distance, _BANDS - 1)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bands: Dict[Tuple[str, int, int], Set[str]] = {}
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(prompt: str, model: str = "") -> str:
+        return hashlib.sha256(f"{model}\n{normalize(prompt)}".encode()).hexdigest()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.fingerprint is not None:
+            for band in _bands(entry.scope, entry.fingerprint):
+                keys = self._bands.get(band)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._bands[band]
+
+    def _alive(self, key: str, entry: _Entry) -> bool:
+        # Пустой ответ (оборванная генерация) - не ответ: удаляем как устаревший
+        if not entry.response or time.monotonic() - entry.created > self.ttl:
+            self._remove(key)
+            return False
+        return True
+
+    def get(self, prompt: str, model: str = "", near_text: Optional[str] = None, scope: str = "") -> Optional[str]:
+        """Сохранённый ответ на тот же (или почти тот же) запрос, иначе None"""
+        key = self.key(prompt, model)
+        entry = self._entries.get(key)
+        if entry is not None and self._alive(key, entry):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _LOOKUPS.inc("hit")
+            return entry.response
+
+        if near_text and self.near_distance > 0:
+            fingerprint = simhash(near_text)
+            candidates = set()
+            for band in _bands(normalize(scope), fingerprint):
+                candidates |= self._bands.get(band, set())
+            best: Optional[Tuple[int, str]] = None
+            for candidate in candidates:
+                other = self._entries.get(candidate)
+                if other is None or not self._alive(candidate, other):
+                    continue
+                distance = bin(fingerprint ^ other.fingerprint).count("1")
+                if distance <= self.near_distance and (best is None or distance < best[0]):
+                    best = (distance, candidate)
+            if best is not None:
+                self._entries.move_to_end(best[1])
+                self.near_hits += 1
+                _LOOKUPS.inc("near_hit")
+                return self._entries[best[1]].response
+
+        self.misses += 1
+        _LOOKUPS.inc("miss")
+        return None
+
+    def put(self, prompt: str, response: str, model: str = "", near_text: Optional[str] = None,
+            scope: str = "") -> None:
+        key = self.key(prompt, model)
+        self._remove(key)
+        scope = normalize(scope)
+        fingerprint = simhash(near_text) if near_text and self.near_distance > 0 else None
+        self._entries[key] = _Entry(response, scope, fingerprint)
+        if fingerprint is not None:
+            for band in _bands(scope, fingerprint):
+                self._bands.setdefault(band, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Один клиент и один пул соединений на процесс
+_client: Optional[AsyncOpenAI] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def get_client() -> AsyncOpenAI:
+    """Возвращает общий AsyncOpenAI клиент (создаётся при первом обращении)"""
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.OPENAI_MAX_CONCURRENCY * 2,
+                max_keepalive_connections=config.OPENAI_MAX_CONCURRENCY,
+            ),
+            timeout=httpx.Timeout(config.OPENAI_TIMEOUT, connect=10.0),
+        )
+        _client = AsyncOpenAI(
+            api_key=config.OPENAI_API_KEY,
+            base_url=config.OPENAI_BASE_URL,
+            timeout=config.OPENAI_TIMEOUT,
+            max_retries=config.OPENAI_MAX_RETRIES,
+            http_client=http_client,
+        )
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(config.OPENAI_MAX_CONCURRENCY)
+    return _semaphore
+
+
+async def chat_completion(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    max_tokens: int = 4000,
+    timeout: Optional[float] = None,
+) -> str:
+    """
+    Выполняет chat completion без блокировки event loop.
+
+    Число одновременных запросов ограничено OPENAI_MAX_CONCURRENCY,
+    остальные ждут своей очереди в семафоре.
+    """
+    client = get_client()
+    async with _get_semaphore():
+        with metrics.track("openai"):
+            response = await client.chat.completions.create(
+                model=model or config.OPENAI_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout or config.OPENAI_TIMEOUT,
+            )
+    return response.choices[0].message.content or ""
+
+
+async def stream_chat_completion(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    max_tokens: int = 4000,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    То же, что chat_completion, но отдаёт ответ по частям (delta) по мере генерации.
+
+    Слот семафора удерживается, пока поток не дочитан до конца.
+    """
+    client = get_client()
+    async with _get_semaphore():
+        # Длительность - до конца потока, включая время, пока вызывающий обрабатывает delta
+        with metrics.track("openai_stream"):
+            stream = await client.chat.completions.create(
+                model=model or config.OPENAI_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout or config.OPENAI_TIMEOUT,
+                stream=True,
+            )
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+            finally:
+                await stream.close()
+
+
+async def close() -> None:
+    """Закрывает пул соединений (вызывается при остановке бота)"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
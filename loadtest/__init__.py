@@ -0,0 +1 @@
+"""Нагрузочный тест бота на фейковых сервисах: python -m loadtest --help"""
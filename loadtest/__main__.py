@@ -0,0 +1,430 @@
+"""
+Нагрузочный тест бота: dp из bot.py на потоке смоделированных апдейтов.
+
+N пользователей одновременно проходят анкету UserStates (генерация,
+перегенерация, выбор сценария), по желанию создают видео HeyGen и
+присылают голосовые сообщения разной длины. Telegram, Muxlisa STT,
+OpenAI и HeyGen заменены локальными фейками (loadtest/fakes.py) с
+настраиваемой задержкой и долей ошибок.
+
+    python -m loadtest --users 50 --voice 10,60,180 --latency openai=1.5 --errors stt=0.05
+    python -m loadtest --users 50 --json new.json --compare baseline.json
+
+Отчёт: p50/p95/p99 длительности обработки апдейта по шагам, голосовое
+сообщение от отправки до результата, задержка event loop и пропускная
+способность. С --compare код выхода 1, если p95 какого-то шага вырос
+больше чем на --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from loadtest.fakes import SERVICES, FakeServices, ServiceProfile, voice_file_id
+
+TOKEN = "123456:LOADTEST"
+FIRST_USER_ID = 100000
+
+# Сообщения, которыми заканчивается обработка голосового сообщения (audio_pipeline)
+VOICE_DONE = ("Qaysi mavzular sizga yoqdi",)
+VOICE_FAILED = ("Audio qayta ishlashda xatolik", "Tanish natijasi bo'sh")
+# Ответ heygen_bot_integration после запроса к HeyGen
+VIDEO_CREATED = ("Video yaratilmoqda!",)
+
+SOHALAR = ("SMM", "Psixologiya", "Ingliz tili", "Fitnes", "Dizayn", "Marketing", "Dasturlash", "Oshpazlik")
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу (значения уже отсортированы)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(values: List[float]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else 0.0,
+    }
+
+
+class Recorder:
+    """Сообщения, отправленные ботом: счётчик и ожидание нужного сообщения в чате"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.sent = 0
+        self._waiters: Dict[int, List[Tuple[Sequence[str], asyncio.Future]]] = {}
+
+    def push_threadsafe(self, chat_id: int, text: str) -> None:
+        self.loop.call_soon_threadsafe(self._push, chat_id, text)
+
+    def _push(self, chat_id: int, text: str) -> None:
+        self.sent += 1
+        for markers, future in self._waiters.get(chat_id, []):
+            if not future.done() and any(marker in text for marker in markers):
+                future.set_result(text)
+
+    def expect(self, chat_id: int, markers: Sequence[str]) -> asyncio.Future:
+        """Future с первым сообщением в чате, содержащим один из markers (регистрировать до шага)"""
+        future = self.loop.create_future()
+        waiter = (markers, future)
+        waiters = self._waiters.setdefault(chat_id, [])
+        waiters.append(waiter)
+        future.add_done_callback(lambda _: waiters.remove(waiter))
+        return future
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, bot_module, recorder: Recorder):
+        self.args = args
+        self.bot_module = bot_module
+        self.dp = bot_module.dp
+        self.bot = bot_module.bot
+        self.recorder = recorder
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.loop_lag: List[float] = []
+        self.updates = 0
+        self.journeys = 0
+        self.sessions: Dict[str, int] = {}
+        self._update_id = 0
+
+    # --- Апдейты ---
+
+    def _update(self, user_id: int, text: Optional[str] = None, voice_seconds: Optional[int] = None,
+                callback_data: Optional[str] = None):
+        from aiogram.types import Update
+
+        self._update_id += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        message = {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+        }
+        if voice_seconds is not None:
+            file_id = voice_file_id(user_id, voice_seconds)
+            message["voice"] = {"file_id": file_id, "file_unique_id": file_id, "duration": voice_seconds,
+                                "mime_type": "audio/wav", "file_size": 44 + voice_seconds * 16000}
+        else:
+            message["text"] = text
+        if callback_data is not None:
+            data = {"update_id": self._update_id, "callback_query": {
+                "id": str(self._update_id), "from": user, "chat_instance": str(user_id),
+                "data": callback_data, "message": message,
+            }}
+        else:
+            data = {"update_id": self._update_id, "message": message}
+        return Update.model_validate(data, context={"bot": self.bot})
+
+    async def _step(self, step: str, update) -> bool:
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors[step] = self.errors.get(step, 0) + 1
+            logging.getLogger("loadtest").debug(f"{step}: {e!r}")
+            return False
+        finally:
+            self.updates += 1
+        self.samples.setdefault(step, []).append(time.perf_counter() - started)
+        return True
+
+    async def _think(self) -> None:
+        if self.args.think:
+            await asyncio.sleep(random.uniform(0, self.args.think))
+
+    # --- Сценарий одного пользователя ---
+
+    def _answers(self, index: int) -> List[str]:
+        soha = SOHALAR[index % len(SOHALAR)]
+        if self.args.same_answers:
+            index = 0
+        return [
+            soha,
+            f"Tadbirkorlar va talabalar, guruh {index}",
+            "Xizmat sotish va obunachi yig'ish",
+            f"Mijozlar vaqt topa olmaydi, {index}-holat",
+            "Odamlar o'ziga ishonch hosil qiladi",
+            f"{index} yil davomida 200 dan ortiq mijoz bilan ishladim",
+            "Amaliy maslahatlar, xatolar tahlili, keyslar",
+            f"Tajriba va shaxsiy yondashuv #{index}",
+        ]
+
+    async def _user(self, index: int) -> None:
+        args = self.args
+        user_id = FIRST_USER_ID + index
+        await asyncio.sleep(args.ramp * index / max(1, args.users))
+
+        answers = self._answers(index)
+        steps = [("start", "/start")] + [("answer", text) for text in answers[:-1]] + [("generate", answers[-1])]
+        for step, text in steps:
+            await self._step(step, self._update(user_id, text))
+            await self._think()
+        await self._step("regenerate", self._update(user_id, "1, 5, 10"))
+        await self._think()
+        await self._step("choose", self._update(user_id, callback_data="finish_generation"))
+        await self._step("scenario", self._update(user_id, "3"))
+        await self._think()
+
+        if args.video:
+            # Видео считается начатым, только если бот ответил "Video yaratilmoqda!"
+            started = time.perf_counter()
+            created = self.recorder.expect(user_id, VIDEO_CREATED)
+            for step, text in (("createvideo", "/createvideo"), ("video_script", answers[-1]),
+                               ("video_avatar", "Avatar 1"), ("video_create", "🎤 Ayol ovozi (ingliz)")):
+                await self._step(step, self._update(user_id, text))
+                await self._think()
+            await self._finish("video_e2e", created, VIDEO_CREATED, started, timeout=5)
+
+        if args.voice:
+            seconds = args.voice[index % len(args.voice)]
+            started = time.perf_counter()
+            delivered = self.recorder.expect(user_id, VOICE_DONE + VOICE_FAILED)
+            await self._step("voice_submit", self._update(user_id, voice_seconds=seconds))
+            await self._finish("voice_e2e", delivered, VOICE_DONE, started, timeout=args.voice_timeout)
+        self.journeys += 1
+
+    async def _finish(self, step: str, future: asyncio.Future, success: Sequence[str], started: float,
+                      timeout: float) -> None:
+        """Ждёт итоговое сообщение сценария; время - от начала сценария"""
+        try:
+            text = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            text = None
+        if text is not None and any(marker in text for marker in success):
+            self.samples.setdefault(step, []).append(time.perf_counter() - started)
+        else:
+            self.errors[step] = self.errors.get(step, 0) + 1
+
+    async def _sample_loop_lag(self, interval: float = 0.05) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, loop.time() - started - interval))
+
+    async def run(self) -> float:
+        import config
+        import http_clients
+
+        await http_clients.startup()
+        monitor = self.bot_module.loop_monitor
+        if monitor is not None:
+            monitor.start()
+        if self.args.voice:
+            self.bot_module.audio_pipeline.start(config.PIPELINE_WORKERS)
+        sampler = asyncio.create_task(self._sample_loop_lag())
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(self._user(i) for i in range(self.args.users)))
+            wall = time.perf_counter() - started
+            self.sessions = await self.bot_module.storage.usage()
+            return wall
+        finally:
+            sampler.cancel()
+            await self._shutdown()
+
+    async def _shutdown(self) -> None:
+        import http_clients
+        import llm_client
+        from media_executor import media_executor
+
+        bot_module = self.bot_module
+        if bot_module.loop_monitor is not None:
+            await bot_module.loop_monitor.stop()
+        await bot_module.audio_pipeline.stop()
+        await bot_module.stt_cache.flush()
+        await media_executor.shutdown()
+        await llm_client.close()
+        await http_clients.shutdown()
+        await bot_module.storage.close()
+        await bot_module.bot.session.close()
+
+
+def _parse_overrides(values: List[str], option: str) -> Dict[str, float]:
+    result = {}
+    for item in values:
+        name, _, value = item.partition("=")
+        if name not in SERVICES or not value:
+            raise SystemExit(f"{option}: ожидается сервис=число, сервисы: {', '.join(SERVICES)}")
+        result[name] = float(value)
+    return result
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m loadtest", description="Нагрузочный тест бота на фейковых сервисах")
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--ramp", type=float, default=2.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think", type=float, default=0.0, help="пауза пользователя между шагами, до N секунд")
+    parser.add_argument("--voice", default="10,60,180",
+                        help="длительности голосовых (секунды, через запятую); пусто - без голосовых")
+    parser.add_argument("--voice-timeout", type=float, default=600, help="ожидание результата голосового")
+    parser.add_argument("--video", action="store_true", help="пройти также /createvideo (HeyGen)")
+    parser.add_argument("--same-answers", action="store_true", help="одинаковые анкеты внутри сферы (проверка кэша)")
+    parser.add_argument("--llm-cache", action="store_true", help="включить LLM_CACHE_ENABLED")
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=SEC",
+                        help="задержка сервиса: telegram, stt, openai, heygen")
+    parser.add_argument("--jitter", action="append", default=[], metavar="SERVICE=SEC", help="разброс задержки")
+    parser.add_argument("--errors", action="append", default=[], metavar="SERVICE=RATE",
+                        help="доля ответов 500 (0..1)")
+    parser.add_argument("--stream-duration", type=float, default=2.0, help="длительность SSE потока OpenAI")
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    parser.add_argument("--compare", help="отчёт-эталон (--json прошлого запуска)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p95 относительно эталона")
+    parser.add_argument("--verbose", action="store_true", help="логи бота")
+    args = parser.parse_args(argv)
+    args.voice = [int(v) for v in args.voice.split(",") if v.strip()]
+    latency = _parse_overrides(args.latency, "--latency")
+    jitter = _parse_overrides(args.jitter, "--jitter")
+    errors = _parse_overrides(args.errors, "--errors")
+    # По умолчанию - правдоподобные задержки; ошибок нет
+    defaults = {"telegram": 0.05, "stt": 0.8, "openai": 0.5, "heygen": 0.3}
+    args.profiles = {
+        name: ServiceProfile(latency.get(name, defaults[name]), jitter.get(name, 0.0), errors.get(name, 0.0))
+        for name in SERVICES
+    }
+    return args
+
+
+def _configure_env(fakes: FakeServices, storage_dir: str, args: argparse.Namespace) -> None:
+    """Переменные окружения до импорта config/bot: все внешние адреса - на фейки"""
+    base = fakes.base_url
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": base,
+        "OPENAI_API_KEY": "loadtest",
+        "OPENAI_BASE_URL": f"{base}/v1",
+        "MUXLISA_API_KEY": "loadtest",
+        "MUXLISA_STT_URL": f"{base}/stt",
+        "HEYGEN_API_KEY": "loadtest",
+        "HEYGEN_BASE_URL": base,
+        "AUDIO_STORAGE_DIR": storage_dir,
+        "FSM_STORAGE": "memory",
+        "METRICS_PORT": "0",
+        "LLM_CACHE_ENABLED": "1" if args.llm_cache else "0",
+    })
+
+
+def _report(test: LoadTest, wall: float, fakes: FakeServices) -> dict:
+    steps = {}
+    for step in sorted(set(test.samples) | set(test.errors)):
+        steps[step] = summarize(test.samples.get(step, []))
+        steps[step]["errors"] = test.errors.get(step, 0)
+    return {
+        "users": test.args.users,
+        "wall_seconds": wall,
+        "steps": steps,
+        "loop_lag": summarize(test.loop_lag),
+        "sessions": test.sessions,
+        "blocked_by_handler": dict(test.bot_module.loop_monitor.blocked) if test.bot_module.loop_monitor else {},
+        "throughput": {
+            "updates_per_second": test.updates / wall if wall else 0.0,
+            "journeys_per_second": test.journeys / wall if wall else 0.0,
+            "bot_messages_per_second": test.recorder.sent / wall if wall else 0.0,
+        },
+        "services": {name: {"requests": fakes.requests[name], "errors": fakes.errors[name]} for name in SERVICES},
+    }
+
+
+def _print_report(report: dict) -> None:
+    ms = lambda seconds: f"{seconds * 1000:9.1f}"
+    print(f"\nПользователей: {report['users']}, время: {report['wall_seconds']:.1f} с\n")
+    print(f"{'шаг':<14}{'n':>6}{'ошибки':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+    for step, row in report["steps"].items():
+        print(f"{step:<14}{row['count']:>6}{row['errors']:>8} {ms(row['p50'])} {ms(row['p95'])} "
+              f"{ms(row['p99'])} {ms(row['max'])}")
+    lag = report["loop_lag"]
+    print(f"\nЗадержка event loop: p50 {lag['p50'] * 1000:.1f} мс, p95 {lag['p95'] * 1000:.1f} мс, "
+          f"p99 {lag['p99'] * 1000:.1f} мс, max {lag['max'] * 1000:.1f} мс")
+    sessions = report["sessions"]
+    if sessions.get("sessions"):
+        print(f"FSM сессии: {sessions['sessions']}, {sessions['total_bytes'] // sessions['sessions']} байт на сессию "
+              f"(максимум {sessions['max_bytes']})")
+    if report["blocked_by_handler"]:
+        print("Блокировки loop по обработчикам: " + ", ".join(
+            f"{handler} {seconds * 1000:.0f} мс" for handler, seconds in
+            sorted(report["blocked_by_handler"].items(), key=lambda item: -item[1])
+        ))
+    tp = report["throughput"]
+    print(f"Пропускная способность: {tp['updates_per_second']:.1f} апдейтов/с, "
+          f"{tp['journeys_per_second']:.2f} пользователей/с, {tp['bot_messages_per_second']:.1f} сообщений бота/с")
+    print("Сервисы: " + ", ".join(
+        f"{name} {row['requests']} ({row['errors']} ошибок)" for name, row in report["services"].items()
+    ))
+
+
+def _compare(report: dict, baseline_path: str, tolerance: float) -> bool:
+    """Сравнивает p95 шагов с эталоном; True - регрессий нет"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    ok = True
+    print(f"\nСравнение с {baseline_path} (допуск +{tolerance:.0%}):")
+    for step, row in report["steps"].items():
+        old = baseline.get("steps", {}).get(step)
+        if not old or not old["p95"]:
+            continue
+        change = row["p95"] / old["p95"] - 1
+        regressed = change > tolerance
+        ok = ok and not regressed
+        print(f"  {step:<14} p95 {old['p95'] * 1000:.1f} -> {row['p95'] * 1000:.1f} мс "
+              f"({change:+.0%}){'  РЕГРЕССИЯ' if regressed else ''}")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    if args.voice and shutil.which("ffmpeg") is None:
+        print("ffmpeg не найден - голосовые сообщения пропущены", file=sys.stderr)
+        args.voice = []
+
+    storage_dir = tempfile.mkdtemp(prefix="impulse_loadtest_")
+    fakes = FakeServices(args.profiles, stream_duration=args.stream_duration)
+    fakes.start()
+    try:
+        _configure_env(fakes, storage_dir, args)
+        import bot as bot_module
+        from heygen_bot_integration import video_tracker
+
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+        video_tracker.path = os.path.join(storage_dir, "video_jobs.json")
+
+        async def run() -> Tuple[LoadTest, float]:
+            recorder = Recorder(asyncio.get_running_loop())
+            fakes.on_message = recorder.push_threadsafe
+            test = LoadTest(args, bot_module, recorder)
+            wall = await test.run()
+            fakes.on_message = None
+            return test, wall
+
+        test, wall = asyncio.run(run())
+    finally:
+        fakes.stop()
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+    report = _report(test, wall, fakes)
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare and not _compare(report, args.compare, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
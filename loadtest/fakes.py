@@ -0,0 +1,266 @@
+"""
+Локальные фейки внешних сервисов для нагрузочного теста.
+
+Один aiohttp сервер (в отдельном потоке со своим event loop, чтобы его
+работа не попадала в измерения бота) отвечает за:
+
+    /bot{token}/{method}        Telegram Bot API
+    /file/bot{token}/{path}     скачивание файлов Telegram (WAV)
+    /stt                        Muxlisa STT
+    /v1/chat/completions        OpenAI (обычный ответ и SSE поток)
+    /v2/avatars, /v2/video/generate, /v1/video_status.get   HeyGen
+
+У каждого сервиса своя задержка, разброс и доля ошибок (ServiceProfile).
+Длительность голосового сообщения зашифрована в file_id: voice_{user}_{seconds}.
+"""
+import asyncio
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+
+SERVICES = ("telegram", "stt", "openai", "heygen")
+VOICE_SAMPLE_RATE = 8000
+AVATAR_COUNT = 60
+
+_NUMBERS_RE = re.compile(r"Mavzular raqamlari: ([\d, ]+)")
+_VOICE_RE = re.compile(r"voice_(\d+)_(\d+)")
+
+MessageCallback = Callable[[int, str], None]
+
+
+class ServiceProfile:
+    """Поведение фейкового сервиса: задержка ответа (с разбросом) и доля ответов 500"""
+    __slots__ = ("latency", "jitter", "error_rate")
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+def voice_file_id(user_id: int, seconds: int) -> str:
+    return f"voice_{user_id}_{seconds}"
+
+
+def _wav(seconds: int, seed: str) -> bytes:
+    """WAV 8кГц моно: шум, уникальный для seed (иначе STT кэш склеит одинаковые файлы)"""
+    data = random.Random(seed).randbytes(seconds * VOICE_SAMPLE_RATE * 2)
+    header = b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE"
+    header += b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, VOICE_SAMPLE_RATE, VOICE_SAMPLE_RATE * 2, 2, 16)
+    return header + b"data" + struct.pack("<I", len(data)) + data
+
+
+def _scenarios_text(numbers: List[int]) -> str:
+    return "".join(
+        f"🎥 Kontent {n}\n"
+        f"<b>Hook:</b> {n}-mavzu: 3 soniyada e'tiborni tortadigan savol.\n"
+        f"<b>Kontent:</b> " + "Qisqa misol, vizual tavsif va asosiy g'oya. " * 6 + "\n\n"
+        for n in numbers
+    )
+
+
+class FakeServices:
+    """
+    Фейковые Telegram, STT, OpenAI и HeyGen на одном порту.
+
+    on_message вызывается (из потока сервера) на каждое отправленное
+    ботом сообщение: on_message(chat_id, text).
+    """
+
+    def __init__(self, profiles: Dict[str, ServiceProfile], stream_duration: float = 2.0,
+                 on_message: Optional[MessageCallback] = None, host: str = "127.0.0.1"):
+        self.profiles = {name: profiles.get(name, ServiceProfile()) for name in SERVICES}
+        self.stream_duration = stream_duration
+        self.on_message = on_message
+        self.host = host
+        self.port = 0
+        self.requests: Dict[str, int] = {name: 0 for name in SERVICES}
+        self.errors: Dict[str, int] = {name: 0 for name in SERVICES}
+        self._message_id = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    # --- Запуск в отдельном потоке ---
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._serve, name="fake-services", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(10):
+            raise RuntimeError("Фейковые сервисы не запустились")
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop = None
+
+    def _serve(self) -> None:
+        loop = self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._telegram)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._telegram_file)
+        app.router.add_post("/stt", self._stt)
+        app.router.add_post("/v1/chat/completions", self._openai)
+        app.router.add_get("/v2/avatars", self._heygen_avatars)
+        app.router.add_post("/v2/video/generate", self._heygen_generate)
+        app.router.add_get("/v1/video_status.get", self._heygen_status)
+        self._runner = web.AppRunner(app, access_log=None)
+        loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, 0)
+        loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        loop.run_forever()
+        loop.close()
+
+    async def _enter(self, service: str) -> bool:
+        """Задержка сервиса; False - этот запрос должен завершиться ошибкой"""
+        profile = self.profiles[service]
+        self.requests[service] += 1
+        delay = profile.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if profile.fails():
+            self.errors[service] += 1
+            return False
+        return True
+
+    # --- Telegram ---
+
+    def _message(self, chat_id: int, text: str) -> dict:
+        self._message_id += 1
+        if self.on_message is not None:
+            self.on_message(chat_id, text)
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+
+    async def _telegram(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        if not await self._enter("telegram"):
+            return web.json_response(
+                {"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500
+            )
+        data = await request.post()
+        if method == "getme":
+            result = {"id": int(request.match_info["token"].split(":")[0]), "is_bot": True,
+                      "first_name": "Impulse", "username": "impulse_loadtest_bot"}
+        elif method in ("sendmessage", "editmessagetext"):
+            result = self._message(int(data["chat_id"]), data.get("text", ""))
+        elif method == "getfile":
+            file_id = data["file_id"]
+            match = _VOICE_RE.search(file_id)
+            seconds = int(match.group(2)) if match else 1
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": 44 + seconds * VOICE_SAMPLE_RATE * 2,
+                "file_path": f"voice/{file_id}.wav",
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _telegram_file(self, request: web.Request) -> web.Response:
+        if not await self._enter("telegram"):
+            return web.Response(status=500)
+        path = request.match_info["path"]
+        match = _VOICE_RE.search(path)
+        seconds = int(match.group(2)) if match else 1
+        body = await asyncio.to_thread(_wav, seconds, path)
+        return web.Response(body=body, content_type="audio/wav")
+
+    # --- Muxlisa STT ---
+
+    async def _stt(self, request: web.Request) -> web.Response:
+        await request.read()
+        if not await self._enter("stt"):
+            return web.json_response({"detail": "fake error"}, status=500)
+        return web.json_response({"text": "Bugun men o'z sohamdagi tajribam haqida gapirib beraman."})
+
+    # --- OpenAI ---
+
+    async def _openai(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if not await self._enter("openai"):
+            return web.json_response({"error": {"message": "fake error", "type": "server_error"}}, status=500)
+        prompt = body["messages"][-1]["content"]
+        match = _NUMBERS_RE.search(prompt)
+        numbers = [int(n) for n in re.findall(r"\d+", match.group(1))] if match else list(range(1, 16))
+        content = _scenarios_text(numbers)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4")
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(prompt) + len(content)) // 4},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        pieces = [content[i:i + 40] for i in range(0, len(content), 40)]
+        interval = self.stream_duration / max(1, len(pieces))
+        for piece in pieces:
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            if interval:
+                await asyncio.sleep(interval)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    # --- HeyGen ---
+
+    async def _heygen_avatars(self, request: web.Request) -> web.Response:
+        if not await self._enter("heygen"):
+            return web.json_response({"error": "fake error"}, status=500)
+        avatars = [{"avatar_id": f"avatar_{i}", "name": f"Avatar {i}", "avatar_name": f"Avatar {i}"}
+                   for i in range(1, AVATAR_COUNT + 1)]
+        return web.json_response({"error": None, "data": {"avatars": avatars}})
+
+    async def _heygen_generate(self, request: web.Request) -> web.Response:
+        await request.read()
+        if not await self._enter("heygen"):
+            return web.json_response({"error": "fake error"}, status=500)
+        return web.json_response({"error": None, "data": {"video_id": uuid.uuid4().hex}})
+
+    async def _heygen_status(self, request: web.Request) -> web.Response:
+        if not await self._enter("heygen"):
+            return web.json_response({"error": "fake error"}, status=500)
+        video_id = request.query.get("video_id", "")
+        return web.json_response({"code": 100, "data": {
+            "id": video_id, "status": "completed", "video_url": f"{self.base_url}/video/{video_id}.mp4",
+        }})
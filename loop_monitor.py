@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from types import CodeType
+from typing import Deque, Dict, Optional, Tuple
+
+from aiogram import Dispatcher
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+LOOP_LAG = metrics.REGISTRY.register(metrics.Histogram(
+    "impulse_loop_lag_seconds", "Опоздание тиков event loop", buckets=LAG_BUCKETS
+))
+BLOCKED_SECONDS = metrics.REGISTRY.register(metrics.Counter(
+    "impulse_loop_blocked_seconds_total", "Время блокировки event loop по обработчикам", ["handler"]
+))
+STALLS = metrics.REGISTRY.register(metrics.Counter(
+    "impulse_loop_stalls_total", "Блокировки event loop дольше порога по обработчикам", ["handler"]
+))
+HANDLER_SECONDS = metrics.REGISTRY.register(metrics.Histogram(
+    "impulse_handler_duration_seconds", "Длительность обработчиков aiogram", ["handler"]
+))
+
+
+class Stall:
+    """Одна блокировка event loop: кто и сколько держал loop, стек в момент блокировки"""
+    __slots__ = ("handler", "seconds", "stack", "at")
+
+    def __init__(self, handler: str, seconds: float, stack: str):
+        self.handler = handler
+        self.seconds = seconds
+        self.stack = stack
+        self.at = time.time()
+
+
+class LoopMonitor:
+    """
+    Сторож event loop.
+
+    Корутина-пульс тикает каждые interval секунд и меряет, насколько тик
+    опоздал (lag). Отдельный поток следит за пульсом: если loop не
+    отвечает дольше threshold, он снимает стек потока loop - это и есть
+    блокирующий код. Виновник определяется по стеку (код обработчика
+    aiogram), а если блокирует не сам обработчик, а его подзадача или
+    фоновая задача - по текущей задаче loop. Когда loop освобождается,
+    время блокировки записывается в метрики по обработчику, а стек - в лог.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: Optional[float] = None, stack_limit: int = 25,
+                 history: int = 20):
+        self.threshold = threshold
+        self.interval = interval or threshold / 2
+        self.stack_limit = stack_limit
+        self.recent: Deque[Stall] = deque(maxlen=history)
+        # Суммарное время блокировки по обработчикам (секунды), как в метрике
+        self.blocked: Dict[str, float] = {}
+        self._dp: Optional[Dispatcher] = None
+        self._handler_codes: Dict[CodeType, str] = {}
+        # Задача loop -> обработчик, который в ней выполняется (заполняет middleware)
+        self._active: Dict[asyncio.Task, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id = 0
+        self._beat = 0.0
+        # Снимок, сделанный сторожем для текущего пульса: (пульс, обработчик, стек)
+        self._capture: Optional[Tuple[float, str, str]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- aiogram ---
+
+    def install(self, dp: Dispatcher) -> None:
+        """Middleware на все события dp (действует и во вложенных роутерах)"""
+        self._dp = dp
+        for name, observer in dp.observers.items():
+            if name != "update":
+                observer.middleware(self._middleware)
+
+    def _collect_handlers(self) -> None:
+        if self._dp is None:
+            return
+        for router in self._dp.chain_tail:
+            for observer in router.observers.values():
+                for handler in observer.handlers:
+                    code = getattr(handler.callback, "__code__", None)
+                    if code is not None:
+                        self._handler_codes[code] = handler.callback.__name__
+
+    async def _middleware(self, handler, event, data):
+        callback = getattr(data.get("handler"), "callback", None)
+        name = getattr(callback, "__name__", type(event).__name__)
+        task = asyncio.current_task()
+        previous = self._active.get(task)
+        self._active[task] = name
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_SECONDS.observe(name, value=time.perf_counter() - started)
+            if previous is None:
+                self._active.pop(task, None)
+            else:
+                self._active[task] = previous
+
+    # --- Пульс и сторож ---
+
+    def alive(self, max_age: float = 30) -> bool:
+        """Пульс тикал не позже max_age секунд назад (для /health)"""
+        return self._task is not None and not self._task.done() and time.monotonic() - self._beat < max_age
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._collect_handlers()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+        logger.info(f"Мониторинг event loop: порог {self.threshold * 1000:.0f} мс")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        beat = self._beat
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - beat - self.interval)
+            LOOP_LAG.observe(value=lag)
+            if lag >= self.threshold:
+                self._record(beat, lag)
+            beat = self._beat = now
+
+    def _record(self, beat: float, lag: float) -> None:
+        capture, self._capture = self._capture, None
+        if capture is not None and capture[0] == beat:
+            _, handler, stack = capture
+        else:
+            # Сторож не успел: блокировка была чуть дольше порога
+            handler, stack = "unknown", ""
+        BLOCKED_SECONDS.inc(handler, amount=lag)
+        STALLS.inc(handler)
+        self.blocked[handler] = self.blocked.get(handler, 0.0) + lag
+        self.recent.append(Stall(handler, lag, stack))
+        logger.warning(f"Event loop заблокирован на {lag * 1000:.0f} мс ({handler})" + (f":\n{stack}" if stack else ""))
+
+    def _watch(self) -> None:
+        """Поток-сторож: снимает стек loop, пока тот заблокирован"""
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            captured = self._capture
+            if (captured is None or captured[0] != beat) and time.monotonic() - beat - self.interval > self.threshold:
+                try:
+                    self._capture = (beat,) + self._snapshot()
+                except Exception as e:
+                    logger.error(f"Не удалось снять стек event loop: {e}")
+
+    def _snapshot(self) -> Tuple[str, str]:
+        """(обработчик, стек) потока event loop в данный момент"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return "unknown", ""
+        stack = "".join(traceback.format_stack(frame, limit=self.stack_limit))
+
+        current = frame
+        while current is not None:
+            name = self._handler_codes.get(current.f_code)
+            if name is not None:
+                return name, stack
+            current = current.f_back
+
+        task = asyncio.current_task(self._loop)
+        if task is None:
+            return "loop", stack
+        name = self._active.get(task)
+        if name is None:
+            coro = task.get_coro()
+            name = getattr(coro, "__qualname__", None) or task.get_name()
+        return name, stack
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, List, Optional, Set
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MediaProcessError(RuntimeError):
+    """ffmpeg/ffprobe завершился с ошибкой или по таймауту"""
+
+
+class _Job:
+    __slots__ = ("cmd", "input", "timeout", "future", "queued_at")
+
+    def __init__(self, cmd: List[str], input: Optional[bytes], timeout: Optional[float]):
+        self.cmd = cmd
+        self.input = input
+        self.timeout = timeout
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+
+class MediaExecutor:
+    """
+    Очередь внешних медиа-процессов (ffmpeg, ffprobe).
+
+    Процессы запускаются через asyncio subprocess и не блокируют event loop.
+    Одновременно работает не больше max_processes (по умолчанию - число ядер).
+    Очередь справедливая: у каждого пользователя своя очередь, свободный слот
+    достаётся пользователям по кругу, поэтому пачка голосовых от одного
+    пользователя не задерживает остальных.
+    """
+
+    def __init__(self, max_processes: Optional[int] = None, timeout: Optional[float] = 300):
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self._queues: "OrderedDict[Hashable, Deque[_Job]]" = OrderedDict()
+        self._running = 0
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+        # Ссылки на задачи запуска: иначе сборщик мусора может удалить задачу посреди работы
+        self._tasks: Set[asyncio.Task] = set()
+        # Статистика
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        """Глубина очереди, занятые слоты и время ожидания слота"""
+        started = self.completed + self.failed
+        return {
+            "queue_depth": self.queue_depth,
+            "queued_users": len(self._queues),
+            "running": self._running,
+            "max_processes": self.max_processes,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait": round(self.total_wait / started, 3) if started else 0.0,
+            "max_wait": round(self.max_wait, 3),
+        }
+
+    async def run(self, user_key: Hashable, cmd: List[str], input: Optional[bytes] = None,
+                  timeout: Optional[float] = None) -> bytes:
+        """Ставит команду в очередь пользователя и возвращает её stdout"""
+        job = _Job(cmd, input, timeout if timeout is not None else self.timeout)
+        self._queues.setdefault(user_key, deque()).append(job)
+        self._pump()
+        return await job.future
+
+    def _pump(self) -> None:
+        while self._running < self.max_processes and self._queues:
+            # Следующий пользователь по кругу: берём одну задачу и ставим его в конец
+            user_key, queue = self._queues.popitem(last=False)
+            job = queue.popleft()
+            if queue:
+                self._queues[user_key] = queue
+            if job.future.cancelled():
+                continue
+            self._running += 1
+            task = asyncio.create_task(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            # Отмена вызывающим (future) отменяет задачу, а она убивает процесс
+            job.future.add_done_callback(lambda future, task=task: task.cancel() if future.cancelled() else None)
+
+    async def _execute(self, job: _Job) -> None:
+        wait = time.monotonic() - job.queued_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait > 5:
+            logger.warning(f"Медиа-задача ждала слот {wait:.1f}с, в очереди: {self.queue_depth}")
+        try:
+            stdout = await self._spawn(job)
+        except asyncio.CancelledError:
+            self.failed += 1
+            job.future.cancel()
+            raise
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(stdout)
+        finally:
+            self._running -= 1
+            self._pump()
+
+    async def _spawn(self, job: _Job) -> bytes:
+        with metrics.track(os.path.basename(job.cmd[0])):
+            return await self._communicate(job)
+
+    async def _communicate(self, job: _Job) -> bytes:
+        process = await asyncio.create_subprocess_exec(
+            *job.cmd,
+            stdin=asyncio.subprocess.PIPE if job.input is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._processes[process.pid] = process
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(job.input), timeout=job.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            process.kill()
+            await process.wait()
+            if isinstance(e, asyncio.TimeoutError):
+                raise MediaProcessError(f"{job.cmd[0]}: таймаут {job.timeout}с") from None
+            raise
+        finally:
+            self._processes.pop(process.pid, None)
+        if process.returncode != 0:
+            raise MediaProcessError(f"{job.cmd[0]} error: {stderr.decode(errors='ignore').strip()}")
+        return stdout
+
+    async def shutdown(self) -> None:
+        """Отменяет очередь и завершает запущенные процессы"""
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        for task in list(self._tasks):
+            task.cancel()
+        for process in list(self._processes.values()):
+            if process.returncode is None:
+                process.kill()
+        self._processes.clear()
+
+
+def ffmpeg_to_wav_cmd(src_path: str, sample_rate: int = 16000) -> List[str]:
+    """Команда ffmpeg: любой аудио-файл -> WAV моно в stdout"""
+    return [
+        "ffmpeg",
+        "-v", "error",
+        "-i", src_path,
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "-f", "wav",
+        "pipe:1",
+    ]
+
+
+media_executor = MediaExecutor(config.MEDIA_MAX_PROCESSES or None, config.MEDIA_PROCESS_TIMEOUT)
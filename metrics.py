@@ -0,0 +1,240 @@
+"""
+Лёгкие метрики в формате Prometheus без внешних зависимостей.
+
+    with metrics.track("muxlisa_stt"):
+        ...
+
+Каждый вызов попадает в гистограмму длительности, счётчик ошибок и
+gauge «сейчас выполняется». Метрики отдаются по HTTP (/metrics), там же
+/health для Docker HEALTHCHECK.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин (секунды): от быстрых операций в памяти до рендера/ответа GPT
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+# Проверки живости для /health: {"loop": True, "storage": False, ...}
+HealthCheck = Callable[[], Awaitable[Dict[str, bool]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return self._header() + [
+            f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Значение задаётся явно (set/inc/dec) или функцией, вызываемой при каждом сборе"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> List[str]:
+        values = self._values
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.error(f"Метрика {self.name}: {e}")
+                values = {}
+        return self._header() + [
+            f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по корзинам..., +Inf], сумма
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {self._sums[key]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CALL_SECONDS = REGISTRY.register(Histogram(
+    "impulse_call_duration_seconds", "Длительность внешних вызовов и тяжёлых операций", ["call"]
+))
+CALL_ERRORS = REGISTRY.register(Counter(
+    "impulse_call_errors_total", "Вызовы, завершившиеся исключением", ["call"]
+))
+CALLS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "impulse_calls_in_flight", "Вызовы, выполняющиеся прямо сейчас", ["call"]
+))
+STARTED_AT = time.time()
+REGISTRY.register(Gauge(
+    "impulse_uptime_seconds", "Время работы процесса", callback=lambda: {(): round(time.time() - STARTED_AT)}
+))
+
+
+class track:
+    """Контекстный менеджер: длительность, ошибки и in-flight для вызова call"""
+    __slots__ = ("call", "started")
+
+    def __init__(self, call: str):
+        self.call = call
+        self.started = 0.0
+
+    def __enter__(self) -> "track":
+        CALLS_IN_FLIGHT.inc(self.call)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        CALL_SECONDS.observe(self.call, value=time.perf_counter() - self.started)
+        CALLS_IN_FLIGHT.dec(self.call)
+        # Отмена и закрытый раньше времени генератор (поток OpenAI) - не ошибки
+        if exc_type is not None and not issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            CALL_ERRORS.inc(self.call)
+        return False
+
+
+def gauge(name: str, help: str, labels: Sequence[str], callback: Callable[[], Dict[LabelValues, float]]) -> Gauge:
+    """Регистрирует gauge, значение которого считается при каждом сборе"""
+    return REGISTRY.register(Gauge(name, help, labels, callback=callback))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+class MetricsServer:
+    """
+    Локальный HTTP сервер: /metrics (Prometheus) и /health.
+
+    /health выполняет проверки health (если заданы) и отвечает 503, если
+    хоть одна не прошла или не уложилась в health_timeout.
+    """
+
+    def __init__(self, host: str, port: int, health: Optional[HealthCheck] = None, health_timeout: float = 5):
+        self.host = host
+        self.port = port
+        self.health = health
+        self.health_timeout = health_timeout
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _health_handler(self, request: web.Request) -> web.Response:
+        checks: Dict[str, bool] = {}
+        if self.health is not None:
+            try:
+                checks = await asyncio.wait_for(self.health(), timeout=self.health_timeout)
+            except Exception as e:
+                logger.error(f"Проверка живости не выполнена: {e}")
+                checks = {"health": False}
+        healthy = all(checks.values())
+        return web.json_response({"ok": healthy, **checks}, status=200 if healthy else 503)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", _metrics_handler)
+        app.router.add_get("/health", self._health_handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
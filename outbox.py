@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from text_split import TELEGRAM_MAX_LENGTH, utf16_len
+
+logger = logging.getLogger(__name__)
+
+PART_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self) -> None:
+        """Обнулить токены (после RetryAfter от Telegram)"""
+        self._refill()
+        self.tokens = 0
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class _ChatLane:
+    __slots__ = ("pending", "task")
+
+    def __init__(self):
+        self.pending: Deque[str] = deque()
+        self.task: Optional[asyncio.Task] = None
+
+
+class Outbox:
+    """
+    Планировщик исходящих сообщений.
+
+    Вместо фиксированного sleep(0.5) после каждой части сообщения проходят
+    через два token bucket: общий на бота и отдельный на каждый чат.
+    Пока чат ждёт токен, новые части копятся и уходят одним сообщением,
+    упакованным до лимита 4096 символов. TelegramRetryAfter обрабатывается
+    ожиданием и повтором.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 max_length: int = TELEGRAM_MAX_LENGTH, max_retries: int = 3):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_length = max_length
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._lanes: Dict[int, _ChatLane] = {}
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # Полные корзины ничего не помнят - их можно выбросить
+                self._buckets = {cid: b for cid, b in self._buckets.items() if not b.is_full}
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def enqueue(self, chat_id: int, text: str) -> None:
+        """Ставит часть текста в очередь чата, не дожидаясь отправки"""
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _ChatLane()
+        lane.pending.append(text)
+        if lane.task is None or lane.task.done():
+            lane.task = asyncio.create_task(self._drain(chat_id, lane))
+
+    async def flush(self, chat_id: int) -> None:
+        """Ждёт, пока все части чата будут отправлены"""
+        lane = self._lanes.get(chat_id)
+        while lane is not None and lane.task is not None and not lane.task.done():
+            await asyncio.shield(lane.task)
+            lane = self._lanes.get(chat_id)
+
+    async def send_parts(self, chat_id: int, parts: Iterable[str]) -> None:
+        """Отправляет части ответа с учётом лимитов и дожидается отправки"""
+        for part in parts:
+            self.enqueue(chat_id, part)
+        await self.flush(chat_id)
+
+    def _take_batch(self, pending: Deque[str]) -> str:
+        """Забирает из очереди столько частей, сколько влезает в одно сообщение"""
+        batch: List[str] = []
+        length = 0
+        sep_len = utf16_len(PART_SEPARATOR)
+        while pending:
+            part = pending[0].strip()
+            part_len = utf16_len(part)
+            if batch and length + sep_len + part_len > self.max_length:
+                break
+            pending.popleft()
+            if not part:
+                continue
+            length += (sep_len if batch else 0) + part_len
+            batch.append(part)
+        return PART_SEPARATOR.join(batch)
+
+    async def _drain(self, chat_id: int, lane: _ChatLane) -> None:
+        bucket = self._bucket(chat_id)
+        try:
+            while lane.pending:
+                await bucket.acquire()
+                await self._global.acquire()
+                text = self._take_batch(lane.pending)
+                if text:
+                    await self._send(chat_id, text, bucket)
+        finally:
+            if not lane.pending and self._lanes.get(chat_id) is lane:
+                del self._lanes[chat_id]
+
+    async def _send(self, chat_id: int, text: str, bucket: TokenBucket) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.bot.send_message(chat_id, text)
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Flood control для чата {chat_id}: ждём {e.retry_after}с")
+                bucket.drain()
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logger.error(f"Error sending message to {chat_id}: {e}")
+                return
+        logger.error(f"Сообщение в чат {chat_id} не отправлено после {self.max_retries} повторов")
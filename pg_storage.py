@@ -0,0 +1,132 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional
+
+import asyncpg
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM хранилище в PostgreSQL.
+
+    Состояние и данные всех пользователей лежат в одной таблице, поэтому
+    несколько процессов бота (polling/webhook воркеры) видят одни и те же
+    анкеты, сценарии и выбранный аватар и не теряют их при перезапуске.
+    Соединения берутся из общего asyncpg пула, который создаётся при первом запросе.
+    """
+
+    def __init__(
+        self,
+        dsn: Optional[str] = None,
+        table: str = "fsm_storage",
+        min_size: int = 1,
+        max_size: int = 10,
+        key_builder: Optional[KeyBuilder] = None,
+        **connect_kwargs: Any,
+    ):
+        self.dsn = dsn
+        self.table = table
+        self.min_size = min_size
+        self.max_size = max_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.connect_kwargs = connect_kwargs
+        self._pool: Optional[asyncpg.Pool] = None
+        self._pool_lock = asyncio.Lock()
+
+    @staticmethod
+    async def _init_connection(conn: asyncpg.Connection) -> None:
+        await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    pool = await asyncpg.create_pool(
+                        self.dsn,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        init=self._init_connection,
+                        **self.connect_kwargs,
+                    )
+                    await pool.execute(
+                        f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                        "key TEXT PRIMARY KEY, "
+                        "state TEXT, "
+                        "data JSONB NOT NULL DEFAULT '{}'::jsonb, "
+                        "updated_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+                    )
+                    self._pool = pool
+                    logger.info(f"FSM storage: подключен PostgreSQL пул ({self.min_size}-{self.max_size})")
+        return self._pool
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        pool = await self._get_pool()
+        await pool.execute(
+            f"INSERT INTO {self.table} (key, state) VALUES ($1, $2) "
+            "ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, updated_at = now()",
+            self.key_builder.build(key),
+            value,
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        pool = await self._get_pool()
+        return await pool.fetchval(f"SELECT state FROM {self.table} WHERE key = $1", self.key_builder.build(key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        pool = await self._get_pool()
+        await pool.execute(
+            f"INSERT INTO {self.table} (key, data) VALUES ($1, $2) "
+            "ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data, updated_at = now()",
+            self.key_builder.build(key),
+            data,
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        pool = await self._get_pool()
+        data = await pool.fetchval(f"SELECT data FROM {self.table} WHERE key = $1", self.key_builder.build(key))
+        return data or {}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Слияние на стороне БД: два воркера не затирают изменения друг друга
+        pool = await self._get_pool()
+        merged = await pool.fetchval(
+            f"INSERT INTO {self.table} (key, data) VALUES ($1, $2) "
+            f"ON CONFLICT (key) DO UPDATE SET data = {self.table}.data || EXCLUDED.data, updated_at = now() "
+            "RETURNING data",
+            self.key_builder.build(key),
+            data,
+        )
+        return dict(merged)
+
+    async def expire(self, idle: float) -> int:
+        """Удаляет сессии, не менявшиеся дольше idle секунд; возвращает их число"""
+        pool = await self._get_pool()
+        result = await pool.execute(
+            f"DELETE FROM {self.table} WHERE updated_at < now() - make_interval(secs => $1)", idle
+        )
+        return int(result.split()[-1])
+
+    async def usage(self) -> Dict[str, int]:
+        """Число сессий и размер их данных (байты jsonb)"""
+        pool = await self._get_pool()
+        row = await pool.fetchrow(
+            f"SELECT count(*), coalesce(sum(pg_column_size(data)), 0), coalesce(max(pg_column_size(data)), 0) "
+            f"FROM {self.table}"
+        )
+        return {"sessions": row[0], "total_bytes": int(row[1]), "max_bytes": int(row[2])}
+
+    async def ping(self) -> None:
+        """Проверка доступности базы (для /health)"""
+        pool = await self._get_pool()
+        await pool.fetchval("SELECT 1")
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Этапы обработки голосового сообщения, по порядку
+STAGES = ("download", "transcribe", "generate", "deliver")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pipeline_jobs (
+    id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    worker TEXT,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pipeline_jobs_ready ON pipeline_jobs (status, available_at);
+"""
+
+
+class PipelineJob:
+    """Задание конвейера, выданное воркеру"""
+    __slots__ = ("id", "chat_id", "user_id", "stage", "attempts", "payload", "worker")
+
+    def __init__(self, id: str, chat_id: int, user_id: int, stage: str, attempts: int, payload: dict,
+                 worker: str = ""):
+        self.id = id
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.stage = stage
+        self.attempts = attempts
+        self.payload = payload
+        self.worker = worker
+
+
+class PipelineQueue:
+    """
+    Персистентная очередь конвейера в SQLite.
+
+    Задание хранит текущий этап и переходит по STAGES. Воркер забирает
+    задание одной атомарной командой UPDATE ... RETURNING и получает аренду
+    (lease); пока этап выполняется, воркер продлевает аренду (renew). Если
+    процесс упал, после истечения аренды задание снова выдаётся - с того же
+    этапа. Записи воркера, потерявшего аренду, не применяются. Файл базы
+    общий, поэтому воркеры могут работать в отдельных процессах на той же
+    машине.
+
+    Методы блокирующие (sqlite ждёт чужую блокировку записи до 30 с), из
+    event loop их вызывают через asyncio.to_thread. Соединение одно на
+    очередь, запросы к нему идут по одному под _lock.
+    """
+
+    def __init__(self, path: str, lease: float = 600, max_attempts: int = 3, retry_delay: float = 10):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> Tuple[List[tuple], int]:
+        """Запрос под блокировкой: (строки результата, число изменённых строк)"""
+        with self._lock:
+            cursor = self._db().execute(sql, params)
+            rows = cursor.fetchall()
+            return rows, cursor.rowcount
+
+    def enqueue(self, chat_id: int, user_id: int, payload: dict) -> str:
+        """Новое задание с первого этапа; возвращает его id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO pipeline_jobs (id, chat_id, user_id, stage, payload, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, chat_id, user_id, STAGES[0], json.dumps(payload, ensure_ascii=False), now, now, now),
+        )
+        return job_id
+
+    def claim(self, worker: str) -> Optional[PipelineJob]:
+        """Забирает самое старое готовое задание (или задание с истёкшей арендой)"""
+        now = time.time()
+        rows, _ = self._execute(
+            "UPDATE pipeline_jobs SET status = 'running', worker = ?, lease_until = ?, updated_at = ? "
+            "WHERE id = (SELECT id FROM pipeline_jobs "
+            "            WHERE (status = 'pending' AND available_at <= ?) "
+            "               OR (status = 'running' AND lease_until < ?) "
+            "            ORDER BY created_at LIMIT 1) "
+            "RETURNING id, chat_id, user_id, stage, attempts, payload",
+            (worker, now + self.lease, now, now, now),
+        )
+        if not rows:
+            return None
+        job_id, chat_id, user_id, stage, attempts, payload = rows[0]
+        return PipelineJob(job_id, chat_id, user_id, stage, attempts, json.loads(payload), worker)
+
+    def renew(self, job: PipelineJob) -> bool:
+        """Продлевает аренду; False - задание уже забрал другой воркер"""
+        now = time.time()
+        _, changed = self._execute(
+            "UPDATE pipeline_jobs SET lease_until = ?, updated_at = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (now + self.lease, now, job.id, job.worker),
+        )
+        return changed > 0
+
+    def advance(self, job: PipelineJob, next_stage: Optional[str]) -> bool:
+        """
+        Фиксирует завершение этапа (checkpoint).
+
+        Следующий этап остаётся за тем же воркером с продлённой арендой;
+        next_stage=None - задание выполнено. False - аренда потеряна.
+        """
+        now = time.time()
+        if next_stage is None:
+            _, changed = self._execute(
+                "UPDATE pipeline_jobs SET status = 'done', payload = ?, error = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND worker = ?",
+                (json.dumps(job.payload, ensure_ascii=False), now, job.id, job.worker),
+            )
+            return changed > 0
+        _, changed = self._execute(
+            "UPDATE pipeline_jobs SET stage = ?, attempts = 0, payload = ?, error = NULL, lease_until = ?, "
+            "updated_at = ? WHERE id = ? AND worker = ?",
+            (next_stage, json.dumps(job.payload, ensure_ascii=False), now + self.lease, now, job.id, job.worker),
+        )
+        job.stage, job.attempts = next_stage, 0
+        return changed > 0
+
+    def fail(self, job: PipelineJob, error: str) -> bool:
+        """
+        Ошибка этапа: повтор с задержкой. Возвращает True, если попытки
+        исчерпаны (и аренда ещё была за этим воркером)
+        """
+        now = time.time()
+        attempts = job.attempts + 1
+        final = attempts >= self.max_attempts
+        _, changed = self._execute(
+            "UPDATE pipeline_jobs SET status = ?, attempts = ?, payload = ?, error = ?, worker = NULL, "
+            "lease_until = NULL, available_at = ?, updated_at = ? WHERE id = ? AND worker = ?",
+            ("failed" if final else "pending", attempts, json.dumps(job.payload, ensure_ascii=False),
+             error[:1000], now + self.retry_delay * attempts, now, job.id, job.worker),
+        )
+        return final and changed > 0
+
+    def pending_before(self, job_id: str) -> int:
+        """Сколько незавершённых заданий стоит в очереди раньше этого"""
+        rows, _ = self._execute(
+            "SELECT COUNT(*) FROM pipeline_jobs WHERE status IN ('pending', 'running') "
+            "AND created_at < (SELECT created_at FROM pipeline_jobs WHERE id = ?)",
+            (job_id,),
+        )
+        return rows[0][0]
+
+    def stats(self) -> Dict[str, int]:
+        """Количество заданий по статусам и этапам: {'pending:transcribe': 2, 'done': 10, ...}"""
+        result: Dict[str, int] = {}
+        rows, _ = self._execute("SELECT status, stage, COUNT(*) FROM pipeline_jobs GROUP BY status, stage")
+        for status, stage, count in rows:
+            key = status if status in ("done", "failed") else f"{status}:{stage}"
+            result[key] = result.get(key, 0) + count
+        return result
+
+    def purge(self, older_than: float) -> int:
+        """Удаляет завершённые и проваленные задания старше older_than секунд"""
+        _, changed = self._execute(
+            "DELETE FROM pipeline_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - older_than,),
+        )
+        return changed
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,44 @@
+"""
+Отдельный процесс-воркер конвейера голосовых сообщений.
+
+Забирает задания из той же очереди (audio_storage/pipeline.sqlite3), что и бот.
+Чтобы обработку вели только такие процессы, в боте ставится PIPELINE_WORKERS=0.
+Состояние пользователя после доставки пишется в FSM хранилище, поэтому
+при нескольких процессах нужен FSM_STORAGE=postgres.
+
+Запуск: python pipeline_worker.py [число_воркеров]
+"""
+import asyncio
+import logging
+import sys
+
+import config
+import http_clients
+import llm_client
+from bot import audio_pipeline, bot, loop_monitor, media_executor, storage, stt_cache
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(1, config.PIPELINE_WORKERS)
+    if config.FSM_STORAGE != "postgres":
+        logger.warning("FSM_STORAGE=memory: состояние пользователя из воркера не увидит процесс бота")
+    await http_clients.startup()
+    if loop_monitor is not None:
+        loop_monitor.start()
+    try:
+        await audio_pipeline.run(workers)
+    finally:
+        await stt_cache.flush()
+        await media_executor.shutdown()
+        await llm_client.close()
+        await http_clients.shutdown()
+        await storage.close()
+        await bot.session.close()
+        if loop_monitor is not None:
+            await loop_monitor.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
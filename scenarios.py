@@ -0,0 +1,155 @@
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from session_store import pack_text, unpack_text
+
+# "🎥 Kontent 7" - заголовок сценария в ответе ChatGPT
+SCENARIO_HEADER_RE = re.compile(r'🎥 Kontent (\d+)')
+SCENARIO_MARKER_RE = re.compile(r'🎥 Kontent \d')
+_HOOK_BODY_RE = re.compile(
+    r'(?:<b>)?Hook:(?:</b>)?\s*(.*?)\s*(?:<b>)?Kontent:(?:</b>)?\s*(.*)', re.DOTALL
+)
+SCENARIO_COUNT = 15
+
+SYSTEM_PROMPT = (
+    "Siz Instagram algoritmini chuqur tahlil qilgan, 100.000+ prosmotr olgan kontentlarni "
+    "analiz qilgan kontent strateg mutaxassissiz."
+)
+
+
+class Scenario:
+    """Один сценарий: номер, hook и описание. Разбирается один раз при получении ответа"""
+    __slots__ = ("number", "hook", "body")
+
+    def __init__(self, number: int, hook: str, body: str):
+        self.number = number
+        self.hook = hook
+        self.body = body
+
+    @classmethod
+    def from_block(cls, block: str) -> Optional["Scenario"]:
+        """Блок '🎥 Kontent N ...' -> Scenario (None, если заголовка нет)"""
+        header = SCENARIO_HEADER_RE.search(block)
+        if header is None:
+            return None
+        rest = block[header.end():].strip()
+        match = _HOOK_BODY_RE.match(rest)
+        if match:
+            return cls(int(header.group(1)), match.group(1), match.group(2).strip())
+        # Модель нарушила формат - сохраняем текст как есть
+        return cls(int(header.group(1)), "", rest)
+
+    def render(self) -> str:
+        if self.hook:
+            return f"🎥 Kontent {self.number}\n<b>Hook:</b> {self.hook}\n<b>Kontent:</b> {self.body}"
+        return f"🎥 Kontent {self.number}\n{self.body}"
+
+    def renumbered(self, number: int) -> "Scenario":
+        return Scenario(number, self.hook, self.body)
+
+    def summary(self) -> str:
+        """Короткое описание для промпта: hook или первая строка текста"""
+        return self.hook or self.body.split("\n", 1)[0]
+
+
+class ScenarioStreamSplitter:
+    """Накапливает поток токенов и выделяет завершённые блоки '🎥 Kontent N'"""
+
+    def __init__(self):
+        self._chunks: List[str] = []  # весь ответ целиком
+        self._pending = ""  # текст текущего (ещё не закрытого) блока
+        self._scan_from = 1
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, delta: str) -> List[str]:
+        """Добавляет очередной кусок ответа, возвращает закрывшиеся блоки"""
+        self._chunks.append(delta)
+        self._pending += delta
+        blocks = []
+        while True:
+            match = SCENARIO_MARKER_RE.search(self._pending, self._scan_from)
+            if not match:
+                break
+            # Блок закрыт, когда начинается следующий маркер
+            blocks.append(self._pending[:match.start()])
+            self._pending = self._pending[match.start():]
+            self._scan_from = 1
+        # Маркер может прийти разорванным между двумя delta - перечитываем хвост
+        self._scan_from = max(1, len(self._pending) - len("🎥 Kontent 0") + 1)
+        return [b for b in blocks if b.strip()]
+
+    def finish(self) -> Optional[str]:
+        """Возвращает последний блок после окончания потока"""
+        block, self._pending = self._pending, ""
+        return block if block.strip() else None
+
+
+def parse_scenarios(text: str) -> List[Scenario]:
+    """Разбирает полный ответ ChatGPT в список сценариев за один проход"""
+    matches = list(SCENARIO_HEADER_RE.finditer(text or ""))
+    scenarios: List[Scenario] = []
+    seen = set()
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        scenario = Scenario.from_block(text[match.start():end])
+        if scenario.number not in seen:
+            seen.add(scenario.number)
+            scenarios.append(scenario)
+    return scenarios
+
+
+def parse_selection(text: str, total: int = SCENARIO_COUNT) -> List[int]:
+    """Номера сценариев из сообщения пользователя ("1, 5, 10" -> [1, 5, 10])"""
+    numbers = []
+    for raw in re.findall(r'\d+', text or ""):
+        number = int(raw)
+        if 1 <= number <= total and number not in numbers:
+            numbers.append(number)
+    return numbers
+
+
+def index_scenarios(scenarios: Iterable[Scenario]) -> Dict[int, Scenario]:
+    return {s.number: s for s in scenarios}
+
+
+def dump_scenarios(scenarios: Iterable[Scenario]) -> Any:
+    """Компактная форма для FSM: [[номер, hook, текст], ...] в JSON, сжатая pack_text"""
+    return pack_text(json.dumps([[s.number, s.hook, s.body] for s in scenarios], ensure_ascii=False))
+
+
+def load_scenarios(value: Any) -> List[Scenario]:
+    """Обратное dump_scenarios; понимает и несжатый список (старые сессии)"""
+    rows = unpack_text(value)
+    if isinstance(rows, str):
+        rows = json.loads(rows)
+    return [Scenario(number, hook, body) for number, hook, body in rows or ()]
+
+
+def chatgpt_messages(user_prompt: str) -> List[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def audio_context(transcript: str) -> str:
+    """Расшифровка голосового сообщения в виде блока для промпта"""
+    return f"Mijozning audio xabari matni: {transcript}\n\n"
+
+
+def audio_prompt(transcript: str) -> str:
+    """Промпт для генерации сценариев по расшифровке голосового сообщения"""
+    return (
+        audio_context(transcript) +
+        "🎯 TOPSHIRIQ:\n"
+        "Yuqoridagi audio matnidan kelib chiqib, Instagram Reels uchun 15 ta viral mavzu yozing.\n\n"
+        "Javobingiz qat'iy quyidagi formatda bo'lsin (har bir mavzu uchun):\n\n"
+        "🎥 Kontent {raqam}\n"
+        "<b>Hook:</b> [Videoni boshlash uchun 3 soniyalik kuchli ilmoq/gap]\n"
+        "<b>Kontent:</b> [Video nima haqida bo'lishi, vizual tavsif va g'oya]\n\n"
+        "Barcha javoblar O'zbek tilida bo'lsin."
+    )
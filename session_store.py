@@ -0,0 +1,140 @@
+import asyncio
+import base64
+import json
+import logging
+import random
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+# Тексты короче порога хранятся как есть: zlib на коротких строках ничего не даёт
+COMPRESS_MIN_BYTES = 512
+_PACKED_KEY = "z"
+
+
+def pack_text(text: Optional[str], min_bytes: int = COMPRESS_MIN_BYTES) -> Any:
+    """
+    Компактная форма текста для FSM данных.
+
+    Длинный текст сжимается zlib и хранится как {"z": base64} - это
+    сериализуется в JSON (PostgresStorage) и не путается с обычной строкой.
+    """
+    if not text:
+        return text
+    raw = text.encode("utf-8")
+    if len(raw) < min_bytes:
+        return text
+    return {_PACKED_KEY: base64.b64encode(zlib.compress(raw, 6)).decode("ascii")}
+
+
+def unpack_text(value: Any) -> Optional[str]:
+    """Обратное pack_text; обычные строки (и старые сессии) возвращаются как есть"""
+    if isinstance(value, dict) and _PACKED_KEY in value:
+        return zlib.decompress(base64.b64decode(value[_PACKED_KEY])).decode("utf-8")
+    return value
+
+
+def data_size(data: Dict[str, Any]) -> int:
+    """Размер данных сессии в байтах (компактный JSON, как в PostgresStorage)"""
+    return len(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+class ExpiringMemoryStorage(MemoryStorage):
+    """
+    MemoryStorage, который помнит время последнего обращения к каждой
+    сессии и умеет удалять простаивающие (expire).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._touched: Dict[StorageKey, float] = {}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._touched[key] = time.monotonic()
+        await super().set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        self._touched[key] = time.monotonic()
+        return await super().get_state(key)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._touched[key] = time.monotonic()
+        await super().set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        self._touched[key] = time.monotonic()
+        return await super().get_data(key)
+
+    async def expire(self, idle: float) -> int:
+        """Удаляет сессии без обращений дольше idle секунд; возвращает их число"""
+        deadline = time.monotonic() - idle
+        stale = [key for key, touched in self._touched.items() if touched < deadline]
+        for key in stale:
+            self.storage.pop(key, None)
+            del self._touched[key]
+        # Записи, созданные defaultdict без обращения через методы выше
+        for key in [key for key in self.storage if key not in self._touched]:
+            self._touched[key] = time.monotonic()
+        return len(stale)
+
+    async def usage(self, sample: int = 1000) -> Dict[str, int]:
+        """Число сессий и их размер; при большом числе размер оценивается по выборке"""
+        records = list(self.storage.values())
+        if not records:
+            return {"sessions": 0, "total_bytes": 0, "max_bytes": 0}
+        measured = random.sample(records, sample) if len(records) > sample else records
+        sizes = [data_size(record.data) for record in measured]
+        return {
+            "sessions": len(records),
+            "total_bytes": sum(sizes) * len(records) // len(sizes),
+            "max_bytes": max(sizes),
+        }
+
+
+class SessionJanitor:
+    """
+    Фоновое обслуживание FSM хранилища: раз в interval секунд удаляет
+    сессии, простаивающие дольше idle, и обновляет last_usage (сессии,
+    байты всего, в среднем и максимум на сессию) для метрик.
+    """
+
+    def __init__(self, storage, idle: float, interval: float = 600):
+        self.storage = storage
+        self.idle = idle
+        self.interval = interval
+        self.last_usage: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self) -> int:
+        expired = await self.storage.expire(self.idle) if self.idle > 0 else 0
+        usage = await self.storage.usage()
+        usage["avg_bytes"] = usage["total_bytes"] // usage["sessions"] if usage["sessions"] else 0
+        self.last_usage = usage
+        logger.info(f"FSM сессии: {usage['sessions']}, ~{usage['avg_bytes']} байт на сессию, "
+                    f"удалено простаивающих: {expired}")
+        return expired
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания FSM сессий: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Категории файлов в audio_storage
+INTERMEDIATE = "intermediate"  # прогресс STT, недописанные .part
+ORIGINAL = "original"  # скачанные из Telegram original.*
+TEXT = "text"  # stt_text.txt, ответ ChatGPT, маркеры этапов
+UPLOAD = "upload"  # аудио для HeyGen из process_audio (uploads/)
+SERVICE = "service"  # индексы и база очереди - не удаляются
+
+UPLOADS_DIR = "uploads"
+INTERMEDIATE_FILES = ("stt_chunks.json",)
+
+
+def _classify(name: str) -> str:
+    if name in INTERMEDIATE_FILES or name.endswith(".part"):
+        return INTERMEDIATE
+    if name.startswith("original"):
+        return ORIGINAL
+    return TEXT
+
+
+def discard_intermediates(work_dir: str) -> int:
+    """Удаляет промежуточные файлы задания (после распознавания); возвращает освобождённые байты"""
+    freed = 0
+    for name in os.listdir(work_dir):
+        if _classify(name) != INTERMEDIATE:
+            continue
+        path = os.path.join(work_dir, name)
+        try:
+            freed += os.path.getsize(path)
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить {path}: {e}")
+    return freed
+
+
+class StorageManager:
+    """
+    Политика хранения audio_storage.
+
+    Промежуточные файлы удаляются сразу после распознавания
+    (discard_intermediates), а оставшиеся от упавших заданий - фоновым
+    проходом через intermediate_max_age. Оригиналы и загрузки для HeyGen
+    удаляются по возрасту, а при превышении общей квоты - начиная с самых
+    старых. Папка задания целиком удаляется, когда её текст старше
+    text_max_age (STT кэш к этому времени тоже его забывает). Задания, ещё
+    не дошедшие до stt_text.txt, не трогаются, пока не устареют.
+    """
+
+    def __init__(self, root_dir: str, original_max_age: float, upload_max_age: float, text_max_age: float,
+                 max_bytes: int, intermediate_max_age: float = 24 * 3600, sweep_interval: float = 3600):
+        self.root_dir = root_dir
+        self.original_max_age = original_max_age
+        self.upload_max_age = upload_max_age
+        self.text_max_age = text_max_age
+        self.max_bytes = max_bytes
+        self.intermediate_max_age = intermediate_max_age
+        self.sweep_interval = sweep_interval
+        self.uploads_dir = os.path.join(root_dir, UPLOADS_DIR)
+        self.last_usage: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def upload_path(self, filename: str) -> str:
+        """Путь для нового файла в uploads/"""
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        return os.path.join(self.uploads_dir, filename)
+
+    def _scan(self) -> Tuple[Dict[str, int], List[Tuple[str, str, float, int]], List[str]]:
+        """Байты по категориям, файлы (категория, путь, mtime, размер) и папки заданий"""
+        usage = {INTERMEDIATE: 0, ORIGINAL: 0, TEXT: 0, UPLOAD: 0, SERVICE: 0}
+        files: List[Tuple[str, str, float, int]] = []
+        work_dirs: List[str] = []
+        for entry in os.scandir(self.root_dir):
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name == UPLOADS_DIR:
+                    children = [(UPLOAD, e) for e in os.scandir(entry.path) if e.is_file()]
+                elif entry.name.startswith("audio_"):
+                    work_dirs.append(entry.path)
+                    children = [(_classify(e.name), e) for e in os.scandir(entry.path) if e.is_file()]
+                else:
+                    continue
+            elif entry.is_file():
+                children = [(SERVICE, entry)]
+            else:
+                continue
+            for category, child in children:
+                stat = child.stat()
+                usage[category] += stat.st_size
+                files.append((category, child.path, stat.st_mtime, stat.st_size))
+        return usage, files, work_dirs
+
+    def usage(self) -> Dict[str, int]:
+        """Сколько байт занимает каждая категория"""
+        return self._scan()[0]
+
+    def sweep(self) -> Dict[str, int]:
+        """Один проход политики хранения; возвращает удалённые байты по категориям"""
+        now = time.time()
+        usage, files, work_dirs = self._scan()
+        removed = {INTERMEDIATE: 0, ORIGINAL: 0, TEXT: 0, UPLOAD: 0}
+
+        def remove(category: str, path: str, size: int) -> None:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить {path}: {e}")
+                return
+            removed[category] += size
+            usage[category] -= size
+
+        # Папки, которые дальше не трогаем: удалённые целиком и задания, ещё не дошедшие до текста
+        skip = set()
+        for work_dir in work_dirs:
+            text_path = os.path.join(work_dir, "stt_text.txt")
+            if os.path.exists(text_path):
+                if now - os.path.getmtime(text_path) > self.text_max_age:
+                    for category, path, _, size in files:
+                        if os.path.dirname(path) == work_dir:
+                            removed[category] += size
+                            usage[category] -= size
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                    skip.add(work_dir)
+            elif now - os.path.getmtime(work_dir) < self.intermediate_max_age:
+                skip.add(work_dir)
+
+        quota_candidates = []
+        for category, path, mtime, size in files:
+            if os.path.dirname(path) in skip:
+                continue
+            age = now - mtime
+            if category == INTERMEDIATE and age > self.intermediate_max_age:
+                remove(category, path, size)
+            elif category == ORIGINAL and age > self.original_max_age:
+                remove(category, path, size)
+            elif category == UPLOAD and age > self.upload_max_age:
+                remove(category, path, size)
+            elif category in (ORIGINAL, UPLOAD):
+                quota_candidates.append((mtime, category, path, size))
+
+        # Квота на аудио: удаляем самые старые оригиналы и загрузки
+        quota_candidates.sort()
+        for mtime, category, path, size in quota_candidates:
+            if usage[ORIGINAL] + usage[UPLOAD] <= self.max_bytes:
+                break
+            remove(category, path, size)
+
+        self.last_usage = usage
+        logger.info(f"Хранилище: занято {usage}, удалено {removed}")
+        return removed
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # Обход диска - в отдельном потоке, чтобы не блокировать event loop
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Ошибка очистки хранилища: {e}", exc_info=True)
+            await asyncio.sleep(self.sweep_interval)
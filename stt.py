@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+import httpx
+
+import config
+import http_clients
+import metrics
+from audio_chunks import WavChunk
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChunkTranscript:
+    """Результат распознавания одного куска аудио"""
+    index: int
+    text: str
+    latency: float  # секунды
+    error: Optional[str] = None
+
+
+def _parse_stt_response(resp: httpx.Response) -> str:
+    try:
+        js = resp.json()
+        for key in ("text", "result", "transcript"):
+            if key in js and isinstance(js[key], str):
+                return js[key]
+        return str(js)
+    except Exception:
+        return resp.text.strip() or ""
+
+
+async def post_to_stt(chunk: WavChunk, filename_for_form: str) -> str:
+    """Отправляет кусок аудио (из памяти) в STT API и возвращает распознанный текст"""
+    headers = {"x-api-key": config.MUXLISA_API_KEY}
+    files = [("audio", (filename_for_form, chunk.open(), "audio/wav"))]
+    with metrics.track("muxlisa_stt"):
+        resp = await http_clients.get_client("stt").post(config.MUXLISA_STT_URL, headers=headers, files=files, data={})
+        resp.raise_for_status()
+    return _parse_stt_response(resp)
+
+
+async def _transcribe_one(index: int, chunk: WavChunk, semaphore: asyncio.Semaphore) -> ChunkTranscript:
+    async with semaphore:
+        started = time.monotonic()
+        try:
+            text = await post_to_stt(chunk, f"{uuid.uuid4().hex}.wav")
+            return ChunkTranscript(index, text.strip(), time.monotonic() - started)
+        except httpx.TimeoutException:
+            logger.error(f"Timeout при запросе к STT для куска {index + 1}")
+            return ChunkTranscript(index, "", time.monotonic() - started, error="timeout")
+        except httpx.HTTPError as e:
+            logger.error(f"Ошибка запроса к STT (кусок {index + 1}): {e}")
+            return ChunkTranscript(index, "", time.monotonic() - started, error=str(e))
+        except Exception as e:
+            # Неожиданный ответ STT не должен отменять распознавание остальных кусков
+            logger.error(f"Ошибка STT (кусок {index + 1}): {e}", exc_info=True)
+            return ChunkTranscript(index, "", time.monotonic() - started, error=str(e) or type(e).__name__)
+
+
+async def transcribe_chunks(chunks: List[WavChunk], max_in_flight: Optional[int] = None) -> List[ChunkTranscript]:
+    """
+    Распознаёт куски параллельно (не более max_in_flight запросов одновременно).
+
+    Результаты возвращаются в порядке кусков, независимо от того,
+    в каком порядке пришли ответы.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight or config.STT_MAX_IN_FLIGHT)
+    results = await asyncio.gather(
+        *(_transcribe_one(i, chunk, semaphore) for i, chunk in enumerate(chunks))
+    )
+    for r in results:
+        if r.text:
+            logger.info(f"Chunk {r.index + 1}/{len(results)} processed: {len(r.text)} chars in {r.latency:.2f}s")
+        else:
+            logger.warning(f"Chunk {r.index + 1}/{len(results)} вернул пустой результат за {r.latency:.2f}s")
+    return list(results)
+
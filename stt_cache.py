@@ -0,0 +1,256 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 содержимого файла (читается блоками)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SttCache:
+    """
+    Кэш результатов STT по содержимому аудио.
+
+    Ключ - SHA-256 скачанного файла; дополнительно запоминается Telegram
+    file_unique_id, чтобы повторную загрузку того же файла можно было
+    узнать ещё до скачивания. Значение - путь к уже сохранённому stt_text.txt
+    (относительно root_dir). Индекс хранится в JSON файле рядом с аудио;
+    изменения копятся и записываются не чаще раза в save_delay секунд,
+    в отдельном потоке (flush - записать сразу). Файл общий для процессов
+    (бот и pipeline_worker.py): перед записью индекс с диска сливается с
+    памятью под блокировкой файла, а записи других процессов подхватываются.
+    """
+
+    def __init__(self, root_dir: str, max_entries: int = 1000, max_bytes: int = 50 * 1024 * 1024,
+                 max_age: float = 30 * 24 * 3600, save_delay: float = 5.0):
+        self.root_dir = root_dir
+        self.index_path = os.path.join(root_dir, "stt_cache_index.json")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.save_delay = save_delay
+        self._entries: Optional[Dict[str, dict]] = None
+        self._file_ids: Dict[str, str] = {}
+        # Обратный индекс: хэш -> его file_unique_id (удаление записи за O(1))
+        self._hash_file_ids: Dict[str, Set[str]] = {}
+        # Хэши, удалённые после последней записи: при слиянии с диском их не возвращаем
+        self._dropped: Set[str] = set()
+        self._disk_mtime = 0.0
+        self._dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+
+    def _read_index(self) -> dict:
+        """Индекс с диска ({"entries", "file_ids"}); пустой, если файла нет или он повреждён"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {"entries": data.get("entries", {}), "file_ids": data.get("file_ids", {})}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать индекс STT кэша: {e}")
+        return {"entries": {}, "file_ids": {}}
+
+    def _index_mtime(self) -> float:
+        try:
+            return os.stat(self.index_path).st_mtime
+        except OSError:
+            return 0.0
+
+    def _load(self) -> Dict[str, dict]:
+        if self._entries is None:
+            self._disk_mtime = self._index_mtime()
+            data = self._read_index()
+            self._entries = data["entries"]
+            self._file_ids = data["file_ids"]
+            for file_unique_id, audio_hash in self._file_ids.items():
+                self._hash_file_ids.setdefault(audio_hash, set()).add(file_unique_id)
+        return self._entries
+
+    def _snapshot(self) -> dict:
+        return {
+            "entries": {audio_hash: dict(entry) for audio_hash, entry in self._entries.items()},
+            "file_ids": dict(self._file_ids),
+        }
+
+    def _write(self, snapshot: dict) -> None:
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _merge_write(self, snapshot: Optional[dict], dropped: Set[str]) -> Tuple[dict, float]:
+        """
+        Под файловой блокировкой читает индекс с диска, сливает его со
+        snapshot (записи этого процесса, без удалённых им dropped) и
+        записывает обратно: индекс общий для бота и pipeline_worker.py.
+        snapshot=None - только прочитать. Возвращает слитый индекс и mtime файла.
+        """
+        with open(self.index_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            disk = self._read_index()
+            if snapshot is None:
+                return disk, self._index_mtime()
+            entries = {h: e for h, e in disk["entries"].items() if h not in dropped}
+            for audio_hash, entry in snapshot["entries"].items():
+                other = entries.get(audio_hash)
+                if other is None or entry["last_used"] >= other["last_used"]:
+                    entries[audio_hash] = entry
+            file_ids = {fid: h for fid, h in disk["file_ids"].items() if h in entries}
+            file_ids.update(snapshot["file_ids"])
+            merged = {"entries": entries, "file_ids": file_ids}
+            self._write(merged)
+            return merged, self._index_mtime()
+
+    def _adopt(self, merged: dict, mtime: float) -> None:
+        """Записи, добавленные другими процессами, - в память"""
+        self._disk_mtime = mtime
+        for audio_hash, entry in merged["entries"].items():
+            if audio_hash not in self._entries and audio_hash not in self._dropped:
+                self._entries[audio_hash] = entry
+        for file_unique_id, audio_hash in merged["file_ids"].items():
+            if file_unique_id not in self._file_ids and audio_hash in self._entries:
+                self._link(file_unique_id, audio_hash)
+        if len(self._entries) > self.max_entries:
+            self._evict(time.time())
+            self._save()
+
+    def _save(self) -> None:
+        """Помечает индекс изменённым; запись - отложенная, вне event loop"""
+        self._dirty = True
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты) пишем сразу
+            self._dirty = False
+            dropped, self._dropped = self._dropped, set()
+            self._adopt(*self._merge_write(self._snapshot(), dropped))
+            return
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self) -> None:
+        await asyncio.sleep(self.save_delay)
+        await self.flush()
+
+    def _check_disk(self) -> None:
+        """Промах: если индекс на диске менялся (другой процесс), подгрузить его в фоне"""
+        if self._index_mtime() == self._disk_mtime:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._adopt(*self._merge_write(None, set()))
+            return
+        self._schedule()
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения индекса (и подхватывает записи других процессов)"""
+        if self._entries is None:
+            return
+        dirty, self._dirty = self._dirty, False
+        dropped, self._dropped = self._dropped, set()
+        try:
+            merged, mtime = await asyncio.to_thread(
+                self._merge_write, self._snapshot() if dirty else None, dropped
+            )
+        except OSError as e:
+            self._dirty = self._dirty or dirty
+            self._dropped |= dropped
+            logger.error(f"Не удалось сохранить индекс STT кэша: {e}")
+            return
+        self._adopt(merged, mtime)
+
+    def _link(self, file_unique_id: str, audio_hash: str) -> None:
+        previous = self._file_ids.get(file_unique_id)
+        if previous is not None and previous != audio_hash:
+            self._hash_file_ids.get(previous, set()).discard(file_unique_id)
+        self._file_ids[file_unique_id] = audio_hash
+        self._hash_file_ids.setdefault(audio_hash, set()).add(file_unique_id)
+
+    def _drop(self, audio_hash: str) -> None:
+        self._entries.pop(audio_hash, None)
+        self._dropped.add(audio_hash)
+        for file_unique_id in self._hash_file_ids.pop(audio_hash, ()):
+            self._file_ids.pop(file_unique_id, None)
+
+    def get_by_hash(self, audio_hash: str) -> Optional[str]:
+        """Возвращает сохранённый текст для аудио с таким хэшем или None"""
+        entries = self._load()
+        entry = entries.get(audio_hash)
+        if entry is None:
+            self._check_disk()
+            return None
+        now = time.time()
+        text_path = os.path.join(self.root_dir, entry["path"])
+        if now - entry["created"] > self.max_age or not os.path.exists(text_path):
+            self._drop(audio_hash)
+            self._save()
+            return None
+        try:
+            with open(text_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError as e:
+            logger.error(f"Ошибка чтения {text_path}: {e}")
+            return None
+        entry["last_used"] = now
+        self._save()
+        return text
+
+    def get_by_file_id(self, file_unique_id: str) -> Optional[str]:
+        """Поиск по Telegram file_unique_id - позволяет не скачивать файл вовсе"""
+        self._load()
+        audio_hash = self._file_ids.get(file_unique_id)
+        if not audio_hash:
+            self._check_disk()
+            return None
+        return self.get_by_hash(audio_hash)
+
+    def add_file_id(self, audio_hash: str, file_unique_id: Optional[str]) -> None:
+        if file_unique_id and audio_hash in self._load() and self._file_ids.get(file_unique_id) != audio_hash:
+            self._link(file_unique_id, audio_hash)
+            self._save()
+
+    def put(self, audio_hash: str, text_path: str, file_unique_id: Optional[str] = None) -> None:
+        """Запоминает путь к stt_text.txt для аудио и применяет политику вытеснения"""
+        entries = self._load()
+        now = time.time()
+        entries[audio_hash] = {
+            "path": os.path.relpath(text_path, self.root_dir),
+            "size": os.path.getsize(text_path),
+            "created": now,
+            "last_used": now,
+        }
+        if file_unique_id:
+            self._link(file_unique_id, audio_hash)
+        self._evict(now)
+        self._save()
+
+    def _evict(self, now: float) -> None:
+        for audio_hash, entry in list(self._entries.items()):
+            if now - entry["created"] > self.max_age:
+                self._drop(audio_hash)
+
+        # Вытесняем давно не использованные записи, пока не влезем в лимиты
+        by_last_used = sorted(self._entries.items(), key=lambda item: item[1]["last_used"])
+        total_bytes = sum(entry["size"] for entry in self._entries.values())
+        for audio_hash, entry in by_last_used:
+            if len(self._entries) <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            total_bytes -= entry["size"]
+            self._drop(audio_hash)
@@ -0,0 +1,110 @@
+"""
+Разбиение длинного текста на сообщения Telegram за один проход.
+
+Границы (маркер сценария, абзац, строка, предложение, слово) находятся
+заранее регулярными выражениями и хранятся как списки смещений. Для каждой
+части ищется самая дальняя граница, влезающая в лимит, - указатели по
+спискам только растут, поэтому текст не пересканируется и строки не
+склеиваются. Длина считается в UTF-16 code units, как у Telegram.
+"""
+import re
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+TELEGRAM_MAX_LENGTH = 4096
+
+# Символы вне BMP (эмодзи и т.п.) занимают в UTF-16 две единицы
+_ASTRAL_RE = re.compile('[\U00010000-\U0010FFFF]')
+
+# Классы границ в порядке предпочтения: смещение = начало следующей части.
+# Граница по словам ищется отдельно (rfind в окне), её список был бы самым длинным
+_BOUNDARY_RES = (
+    re.compile(r'(?=🎥 Kontent \d)'),
+    re.compile(r'\n[ \t]*\n\s*'),
+    re.compile(r'\n\s*'),
+    re.compile(r'[.!?…]+["»)]?\s+'),
+)
+_SCENARIO_MARKER = "🎥 Kontent"
+
+# Предпочтительную границу берём, только если часть выходит не короче половины лимита
+_MIN_FILL = 0.5
+
+
+def utf16_len(text: str) -> int:
+    """Длина текста так, как её считает Telegram (в UTF-16 code units)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_offsets(text: str, max_length: int = TELEGRAM_MAX_LENGTH) -> List[Tuple[int, int]]:
+    """Границы частей [(start, end), ...] - каждая часть не длиннее max_length в UTF-16"""
+    n = len(text)
+    astral = [m.start() for m in _ASTRAL_RE.finditer(text)]
+
+    def u16(i: int) -> int:
+        return i + bisect_left(astral, i)
+
+    boundaries: List[Optional[List[int]]] = [None] * len(_BOUNDARY_RES)
+    pointers = [0] * len(_BOUNDARY_RES)
+
+    def offsets_of(cls: int) -> List[int]:
+        # Списки строятся лениво: до предложений дело доходит, только если нет абзацев
+        if boundaries[cls] is None:
+            if cls == 0 and _SCENARIO_MARKER not in text:
+                boundaries[cls] = []
+            else:
+                boundaries[cls] = [m.end() for m in _BOUNDARY_RES[cls].finditer(text)]
+        return boundaries[cls]
+
+    total = u16(n)
+    parts: List[Tuple[int, int]] = []
+
+    start = 0
+    while start < n and text[start].isspace():
+        start += 1
+    while start < n:
+        start_u16 = u16(start)
+        if total - start_u16 <= max_length:
+            end = n
+        else:
+            # Самый дальний символ, до которого часть ещё влезает в лимит
+            lo, hi = start + 1, min(n, start + max_length)
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if u16(mid) - start_u16 <= max_length:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            limit_end = lo
+            end = limit_end
+            min_end = start_u16 + max_length * _MIN_FILL
+            for cls in range(len(_BOUNDARY_RES)):
+                offsets = offsets_of(cls)
+                i = pointers[cls]
+                while i < len(offsets) and offsets[i] <= limit_end:
+                    i += 1
+                pointers[cls] = i
+                if i and offsets[i - 1] > start and u16(offsets[i - 1]) >= min_end:
+                    end = offsets[i - 1]
+                    break
+            else:
+                # Граница по словам: последний пробел в окне, иначе режем по лимиту
+                space = max(text.rfind(" ", start + 1, limit_end + 1), text.rfind("\n", start + 1, limit_end + 1))
+                if space > start:
+                    end = space + 1
+        # Пробелы на стыке частей не отправляем
+        stop = end
+        while stop > start and text[stop - 1].isspace():
+            stop -= 1
+        if stop > start:
+            parts.append((start, stop))
+        start = end
+        while start < n and text[start].isspace():
+            start += 1
+    return parts
+
+
+def split_text(text: str, max_length: int = TELEGRAM_MAX_LENGTH) -> List[str]:
+    """Разбивает текст на части для Telegram (по сценариям, абзацам, предложениям, словам)"""
+    if utf16_len(text) <= max_length:
+        return [text]
+    return [text[start:end] for start, end in split_offsets(text, max_length)]
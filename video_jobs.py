@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot
+
+from heygen_client import HeyGenClient
+
+logger = logging.getLogger(__name__)
+
+# notify(bot, job, status) - status: 'completed' | 'failed' | 'timeout'
+NotifyCallback = Callable[[Bot, dict, str], Awaitable[None]]
+
+
+class VideoJobTracker:
+    """
+    Фоновое отслеживание рендеров HeyGen.
+
+    Обработчик только регистрирует video_id (submit) и сразу освобождается.
+    Все незавершённые видео стоят на одном общем таймере: у каждого есть
+    время следующей проверки, цикл просыпается к ближайшему и заодно
+    проверяет все видео, чья очередь наступит в пределах coalesce_window.
+
+    Интервал адаптивный: пока видео заведомо не готово (меньше ~60% от
+    среднего времени рендера) - не опрашиваем вовсе, около ожидаемого
+    момента - каждые min_interval секунд, после - с растущим интервалом
+    до max_interval. Среднее время рендера обновляется по факту (EWMA).
+    Список заданий и статистика хранятся в JSON файле, поэтому после
+    перезапуска опрос продолжается.
+    """
+
+    def __init__(self, path: str, notify: NotifyCallback, min_interval: float = 10, max_interval: float = 120,
+                 expected_duration: float = 120, coalesce_window: float = 3,
+                 max_wait: float = 30 * 60, max_parallel_checks: int = 5):
+        self.path = path
+        self.notify = notify
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.coalesce_window = coalesce_window
+        self.max_wait = max_wait
+        self.max_parallel_checks = max_parallel_checks
+        self.jobs: Dict[str, dict] = {}
+        self.expected_duration = expected_duration
+        self.status_calls = 0
+        self.status_calls_saved = 0
+        self._client: Optional[HeyGenClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+            return
+        if "jobs" not in data:
+            data = {"jobs": data}  # старый формат: просто словарь заданий
+        self.jobs = data["jobs"]
+        self.expected_duration = data.get("expected_duration", self.expected_duration)
+        self.status_calls = data.get("status_calls", 0)
+        self.status_calls_saved = data.get("status_calls_saved", 0)
+        logger.info(f"HeyGen: восстановлено незавершённых видео: {len(self.jobs)}")
+
+    def _save(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "jobs": self.jobs,
+                "expected_duration": self.expected_duration,
+                "status_calls": self.status_calls,
+                "status_calls_saved": self.status_calls_saved,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> dict:
+        """Статистика опроса: сколько запросов сделано и сколько сэкономлено"""
+        return {
+            "pending": len(self.jobs),
+            "status_calls": self.status_calls,
+            "status_calls_saved": self.status_calls_saved,
+            "expected_duration": round(self.expected_duration, 1),
+        }
+
+    def _next_interval(self, elapsed: float) -> float:
+        expected = self.expected_duration
+        if elapsed < expected * 0.6:
+            return max(self.min_interval, expected * 0.6 - elapsed)
+        if elapsed < expected * 1.5:
+            return self.min_interval
+        return min(self.max_interval, max(self.min_interval, elapsed * 0.2))
+
+    def submit(self, video_id: str, chat_id: int, **extra) -> None:
+        """Регистрирует видео для отслеживания и сразу возвращает управление"""
+        now = time.time()
+        self.jobs[video_id] = {
+            "video_id": video_id,
+            "chat_id": chat_id,
+            "submitted_at": now,
+            "next_check": now + self._next_interval(0),
+            "checks": 0,
+            **extra,
+        }
+        self._save()
+        self._wakeup.set()
+
+    def start(self, bot: Bot) -> None:
+        api_key = os.getenv('HEYGEN_API_KEY')
+        if not api_key:
+            logger.warning("HEYGEN_API_KEY не задан, отслеживание видео отключено")
+            return
+        self._client = HeyGenClient(api_key)
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            if self.jobs:
+                nearest = min(job.get("next_check", 0) for job in self.jobs.values())
+                timeout = nearest - time.time()
+            if timeout is None or timeout > 0:
+                try:
+                    # Ждём ближайшей проверки или нового submit
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self._poll_due(bot)
+            except Exception as e:
+                logger.error(f"Ошибка опроса статусов HeyGen: {e}", exc_info=True)
+                await asyncio.sleep(self.min_interval)
+
+    async def _poll_due(self, bot: Bot) -> None:
+        semaphore = asyncio.Semaphore(self.max_parallel_checks)
+        horizon = time.time() + self.coalesce_window
+        due = [job for job in self.jobs.values() if job.get("next_check", 0) <= horizon]
+
+        async def check(job: dict):
+            async with semaphore:
+                return job, await self._client.check_video_status(job["video_id"])
+
+        results = await asyncio.gather(*(check(job) for job in due))
+        now = time.time()
+        self.status_calls += len(results)
+        for job, status in results:
+            job["checks"] = job.get("checks", 0) + 1
+            elapsed = now - job["submitted_at"]
+            video_status = (status or {}).get('data', {}).get('status')
+            if video_status in ("completed", "failed"):
+                if video_status == "completed":
+                    # EWMA фактической длительности рендера
+                    self.expected_duration = 0.8 * self.expected_duration + 0.2 * elapsed
+                job["video_url"] = status['data'].get('video_url', '')
+                await self._finish(bot, job, video_status, elapsed)
+            elif elapsed > self.max_wait:
+                await self._finish(bot, job, "timeout", elapsed)
+            else:
+                job["next_check"] = now + self._next_interval(elapsed)
+        self._save()
+
+    async def _finish(self, bot: Bot, job: dict, result: str, elapsed: float) -> None:
+        self.jobs.pop(job["video_id"], None)
+        # Сколько запросов сделал бы фиксированный опрос раз в min_interval секунд
+        self.status_calls_saved += max(0, int(elapsed // self.min_interval) + 1 - job["checks"])
+        self._save()
+        logger.info(f"HeyGen видео {job['video_id']}: {result} за {elapsed:.0f}с, проверок: {job['checks']}")
+        try:
+            await self.notify(bot, job, result)
+        except Exception as e:
+            logger.error(f"Не удалось уведомить чат {job['chat_id']}: {e}")
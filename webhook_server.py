@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def _chat_key(update: Update) -> Optional[int]:
+    """chat_id апдейта (для ограничения параллельности внутри одного чата)"""
+    event = update.event
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = event.message.chat  # callback_query
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else None
+
+
+class _ChatLane:
+    """Очередь апдейтов одного чата"""
+    __slots__ = ("pending", "in_flight", "tokens")
+
+    def __init__(self):
+        self.pending: Deque[Update] = deque()
+        self.in_flight = 0
+        self.tokens = 0  # сколько раз чат уже стоит в общей очереди готовых
+
+
+class UpdateWorkerPool:
+    """
+    Пул обработчиков апдейтов для webhook режима.
+
+    Апдейт принимается мгновенно (submit), а обрабатывается одним из
+    `workers` фоновых задач. Внутри одного чата одновременно выполняется
+    не более `per_chat_limit` апдейтов, в порядке поступления; занятый чат
+    не занимает воркеров, пока ждёт своей очереди.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = 16, max_pending: int = 1000, per_chat_limit: int = 1):
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.max_pending = max_pending
+        self.per_chat_limit = per_chat_limit
+        self._lanes: Dict[Optional[int], _ChatLane] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._pending_total = 0
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def pending(self) -> int:
+        return self._pending_total
+
+    def _schedule(self, key: Optional[int], lane: _ChatLane) -> None:
+        if len(lane.pending) > lane.tokens and lane.tokens + lane.in_flight < self.per_chat_limit:
+            lane.tokens += 1
+            self._ready.put_nowait(key)
+
+    def submit(self, update: Update) -> bool:
+        """Ставит апдейт в очередь. False - очередь переполнена"""
+        if self._pending_total >= self.max_pending:
+            return False
+        key = _chat_key(update)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _ChatLane()
+        lane.pending.append(update)
+        self._pending_total += 1
+        self._schedule(key, lane)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            lane.tokens -= 1
+            update = lane.pending.popleft()
+            self._pending_total -= 1
+            lane.in_flight += 1
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+            finally:
+                lane.in_flight -= 1
+                self._schedule(key, lane)
+                if not lane.pending and not lane.in_flight and not lane.tokens:
+                    del self._lanes[key]
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def create_app(pool: UpdateWorkerPool, path: str, secret: Optional[str] = None) -> web.Application:
+    """aiohttp приложение: принимает апдейт, кладёт в пул и сразу отвечает 200"""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=401)
+        update = Update.model_validate(await request.json(), context={"bot": pool.bot})
+        if not pool.submit(update):
+            # Telegram повторит доставку позже
+            logger.warning("Очередь апдейтов переполнена, апдейт отклонён")
+            return web.Response(status=503)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, *, base_url: str, path: str, host: str, port: int,
+                      secret: Optional[str], workers: int, max_pending: int, per_chat_limit: int) -> None:
+    """Регистрирует webhook и обслуживает входящие апдейты до отмены задачи"""
+    pool = UpdateWorkerPool(dp, bot, workers=workers, max_pending=max_pending, per_chat_limit=per_chat_limit)
+    runner = web.AppRunner(create_app(pool, path, secret))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+
+    await dp.emit_startup(bot=bot)
+    pool.start()
+    try:
+        await site.start()
+        await bot.set_webhook(base_url.rstrip("/") + path, secret_token=secret)
+        logger.info(f"Webhook режим: {host}:{port}{path}, воркеров: {workers}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await pool.stop()
+        await dp.emit_shutdown(bot=bot)